@@ -0,0 +1,109 @@
+import asyncio
+import time
+from collections import deque
+
+# Responses that mean the server is pushing back
+THROTTLE_STATUSES = (429, 503)
+# Seconds of completed requests the reported rate is averaged over
+RATE_WINDOW = 10
+
+
+# Additive-increase/multiplicative-decrease limit on requests in flight.
+# Every healthy response raises the limit by increase/limit (about
+# `increase` per round of `limit` requests); a 429/503, another 5xx or
+# failed request, or a latency spike cuts it by `decrease`, at most once per
+# round trip so one burst of failures counts as a single signal.
+class AIMDController:
+    def __init__(
+        self,
+        initial=10,
+        floor=1,
+        ceiling=64,
+        increase=1.0,
+        decrease=0.5,
+        latency_spike=3.0,
+        clock=time.monotonic,
+    ):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_spike = latency_spike
+        self.clock = clock
+        self.limit = float(min(max(initial, floor), ceiling))
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        # moving average of response latency, the baseline for spikes
+        self.latency = None
+        self.last_decrease = None
+        self.completed = deque()
+        self.started_at = clock()
+        self.counts = {"ok": 0, "throttled": 0, "error": 0, "slow": 0}
+        self.peak_limit = self.limit
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    # status is None for requests that failed without a response
+    async def release(self, status, latency):
+        self.record(status, latency)
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record(self, status, latency):
+        now = self.clock()
+        self.completed.append(now)
+        if status in THROTTLE_STATUSES:
+            self.counts["throttled"] += 1
+            self.cut(now)
+            return
+        if status is None or status >= 500:
+            self.counts["error"] += 1
+            self.cut(now)
+            return
+
+        spike = self.latency is not None and latency > self.latency * self.latency_spike
+        self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+        if spike:
+            self.counts["slow"] += 1
+            self.cut(now)
+        else:
+            self.counts["ok"] += 1
+            self.limit = min(self.ceiling, self.limit + self.increase / self.limit)
+            self.peak_limit = max(self.peak_limit, self.limit)
+
+    def cut(self, now):
+        round_trip = self.latency or 1.0
+        if self.last_decrease is not None and now - self.last_decrease < round_trip:
+            return
+        self.limit = max(self.floor, self.limit * self.decrease)
+        self.last_decrease = now
+
+    def rate(self):
+        # requests completed per second over the last RATE_WINDOW seconds
+        now = self.clock()
+        while self.completed and self.completed[0] < now - RATE_WINDOW:
+            self.completed.popleft()
+        window = min(RATE_WINDOW, now - self.started_at)
+        return len(self.completed) / window if window > 0 else 0.0
+
+    def report(self):
+        return (
+            f"Concurrency {self.limit:.1f} ({self.in_flight} in flight), "
+            f"{self.rate():.1f} req/s, {self.counts['throttled']} throttled, "
+            f"{self.counts['error']} errors, {self.counts['slow']} slow"
+        )
+
+    def summary(self):
+        total = sum(self.counts.values())
+        elapsed = self.clock() - self.started_at
+        average = total / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{total} requests at {average:.1f} req/s, concurrency peaked at "
+            f"{self.peak_limit:.1f} and ended at {self.limit:.1f} "
+            f"({self.counts['throttled']} throttled, {self.counts['error']} errors, "
+            f"{self.counts['slow']} slow)"
+        )
@@ -0,0 +1,329 @@
+import os
+import glob
+import sqlite3
+import hashlib
+import zlib
+import zipfile
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from utils import write_json_to_file, logger
+from metrics import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "..", "..", "data")
+INDEX_PATH = os.path.join(BASE_DIR, "archive_index.sqlite3")
+# Bytes read from a zip entry at a time while hashing
+CHUNK_SIZE = 1 << 20
+# Archives with more entries are hashed in slices of this many entries by
+# several workers
+ENTRIES_PER_TASK = 500
+# Slices handed to the pool ahead of the one being recorded
+TASKS_IN_FLIGHT = 64
+
+
+def archive_kind(archive_path):
+    # "darkreader-src.zip" -> "src"; archives not named <name>-<kind>.zip
+    # are labelled with their file name
+    stem = os.path.splitext(os.path.basename(archive_path))[0]
+    return stem.rsplit("-", 1)[1] if "-" in stem else stem
+
+
+def find_archives(data_dir):
+    # data/<extension>/*.zip, in a stable order
+    return sorted(glob.glob(os.path.join(data_dir, "*", "*.zip")))
+
+
+def hash_entries(archive_path, start, end):
+    # Runs in a worker process. Streams entries start..end of the archive
+    # through sha256 without extracting them; returns (path, size, hash) of
+    # each file and the paths of entries that could not be read.
+    results, unreadable = list(), list()
+    with zipfile.ZipFile(archive_path) as zf:
+        for info in zf.infolist()[start:end]:
+            if info.is_dir():
+                continue
+            digest = hashlib.sha256()
+            try:
+                with zf.open(info) as entry:
+                    while chunk := entry.read(CHUNK_SIZE):
+                        digest.update(chunk)
+            except (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError):
+                # corrupt, encrypted or unsupported compression
+                unreadable.append(info.filename)
+                continue
+            results.append((info.filename, info.file_size, digest.hexdigest()))
+    return archive_path, results, unreadable
+
+
+def entry_slices(archive_path):
+    with zipfile.ZipFile(archive_path) as zf:
+        num_entries = len(zf.infolist())
+    return [
+        (archive_path, start, start + ENTRIES_PER_TASK)
+        for start in range(0, max(num_entries, 1), ENTRIES_PER_TASK)
+    ]
+
+
+# Content-addressed index of the files inside extension archives: each
+# sha256 of file contents maps to every (extension, archive, path) it occurs
+# at, so identical files across src/dist archives and across extensions are
+# found with one query. Archives are re-indexed only when their size or
+# modification time changes.
+class ArchiveIndex:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS archives (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                extension TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS occurrences (
+                archive_id INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (archive_id, path)
+            );
+            CREATE INDEX IF NOT EXISTS occurrences_hash ON occurrences (hash);
+            """
+        )
+
+    def is_current(self, archive_path):
+        stat = os.stat(archive_path)
+        row = self.conn.execute(
+            "SELECT size, mtime FROM archives WHERE path = ?",
+            (os.path.abspath(archive_path),),
+        ).fetchone()
+        return row == (stat.st_size, stat.st_mtime)
+
+    def begin_archive(self, archive_path):
+        # Registers the archive, dropping what an earlier version of it held;
+        # returns its id. Its size and mtime are only recorded by
+        # finish_archive, so an interrupted run indexes it again.
+        path = os.path.abspath(archive_path)
+        extension = os.path.basename(os.path.dirname(path))
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM occurrences WHERE archive_id = "
+                "(SELECT id FROM archives WHERE path = ?)",
+                (path,),
+            )
+            self.conn.execute(
+                "INSERT INTO archives (path, extension, kind, size, mtime) "
+                "VALUES (?, ?, ?, -1, -1) ON CONFLICT (path) DO UPDATE SET "
+                "size = -1, mtime = -1",
+                (path, extension, archive_kind(path)),
+            )
+        return self.conn.execute(
+            "SELECT id FROM archives WHERE path = ?", (path,)
+        ).fetchone()[0]
+
+    def finish_archive(self, archive_path):
+        path = os.path.abspath(archive_path)
+        stat = os.stat(path)
+        with self.conn:
+            self.conn.execute(
+                "UPDATE archives SET size = ?, mtime = ? WHERE path = ?",
+                (stat.st_size, stat.st_mtime, path),
+            )
+
+    def forget(self, archive_path):
+        # Drops an archive and what it held, e.g. once it cannot be read
+        path = os.path.abspath(archive_path)
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM occurrences WHERE archive_id = "
+                "(SELECT id FROM archives WHERE path = ?)",
+                (path,),
+            )
+            self.conn.execute("DELETE FROM archives WHERE path = ?", (path,))
+
+    def record(self, archive_id, entries):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO blobs (hash, size) VALUES (?, ?)",
+                ((digest, size) for _, size, digest in entries),
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO occurrences (archive_id, path, hash) VALUES (?, ?, ?)",
+                ((archive_id, path, digest) for path, _, digest in entries),
+            )
+
+    def prune(self, archive_paths):
+        # Forgets archives that are gone and blobs no archive holds any more
+        current = {os.path.abspath(path) for path in archive_paths}
+        stale = [
+            (archive_id,)
+            for archive_id, path in self.conn.execute("SELECT id, path FROM archives")
+            if path not in current
+        ]
+        with self.conn:
+            self.conn.executemany("DELETE FROM occurrences WHERE archive_id = ?", stale)
+            self.conn.executemany("DELETE FROM archives WHERE id = ?", stale)
+            self.conn.execute(
+                "DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM occurrences)"
+            )
+
+    def occurrences(self, digest):
+        return self.conn.execute(
+            "SELECT a.extension, a.kind, o.path FROM occurrences o "
+            "JOIN archives a ON a.id = o.archive_id WHERE o.hash = ? "
+            "ORDER BY a.extension, a.kind, o.path",
+            (digest,),
+        ).fetchall()
+
+    def duplicates(self, across_extensions=False):
+        # (hash, size, occurrences) of every file found more than once (in
+        # more than one extension with across_extensions), largest first
+        having = "COUNT(DISTINCT a.extension) > 1" if across_extensions else "COUNT(*) > 1"
+        rows = self.conn.execute(
+            "SELECT o.hash, b.size FROM occurrences o "
+            "JOIN archives a ON a.id = o.archive_id JOIN blobs b ON b.hash = o.hash "
+            f"GROUP BY o.hash HAVING {having} ORDER BY b.size DESC, o.hash"
+        )
+        for digest, size in rows:
+            yield digest, size, self.occurrences(digest)
+
+    def stats(self):
+        def count(query):
+            return self.conn.execute(query).fetchone()[0]
+
+        return {
+            "archives": count("SELECT COUNT(*) FROM archives"),
+            "files": count("SELECT COUNT(*) FROM occurrences"),
+            "unique_files": count("SELECT COUNT(*) FROM blobs"),
+            "duplicated_files": count(
+                "SELECT COUNT(*) FROM (SELECT hash FROM occurrences "
+                "GROUP BY hash HAVING COUNT(*) > 1)"
+            ),
+            "unique_bytes": count("SELECT COALESCE(SUM(size), 0) FROM blobs"),
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+def index_archives(index, archive_paths, num_workers=None, reindex=False):
+    # Hashes the entries of every new or changed archive in a process pool.
+    # Slices are submitted TASKS_IN_FLIGHT at a time and recorded as they
+    # complete, so memory holds a bounded number of slice results whatever
+    # the number of archives.
+    archive_ids, slices_left, tasks = dict(), dict(), list()
+    for path in archive_paths:
+        if not reindex and index.is_current(path):
+            continue
+        try:
+            slices = entry_slices(path)
+        except zipfile.BadZipFile as e:
+            # an earlier, readable version of the archive must not stay indexed
+            logger.error(f"Skipping {path}: {e}")
+            index.forget(path)
+            continue
+        archive_ids[path] = index.begin_archive(path)
+        slices_left[path] = len(slices)
+        tasks.extend(slices)
+
+    indexed_files = 0
+
+    def record(future):
+        nonlocal indexed_files
+        archive_path, entries, unreadable = future.result()
+        for name in unreadable:
+            logger.error(f"Could not read {name} in {archive_path}")
+        index.record(archive_ids[archive_path], entries)
+        indexed_files += len(entries)
+        metrics.inc("items_total", len(entries), stage="archive_index")
+        slices_left[archive_path] -= 1
+        if slices_left[archive_path] == 0:
+            index.finish_archive(archive_path)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(hash_entries, *task))
+            if len(pending) >= TASKS_IN_FLIGHT:
+                record(pending.popleft())
+        while pending:
+            record(pending.popleft())
+    index.prune(archive_paths)
+    return len(archive_ids), indexed_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index the files inside extension source and dist archives by content hash"
+    )
+    parser.add_argument(
+        "data_dir",
+        type=str,
+        nargs="?",
+        default=DATA_DIR,
+        help="Directory holding <extension>/*.zip archives",
+    )
+    parser.add_argument(
+        "--index_path",
+        type=str,
+        default=INDEX_PATH,
+        help="SQLite file of the content-addressed index",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Processes hashing archive entries (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Hash every archive again, including unchanged ones",
+    )
+    parser.add_argument(
+        "--duplicates_output_path",
+        type=str,
+        help="Write every file found more than once, with where it occurs, to this json file",
+    )
+    parser.add_argument(
+        "--across_extensions",
+        action="store_true",
+        help="Only report files shared by more than one extension",
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_run(args.metrics_path, args.metrics_interval)
+
+    archive_paths = find_archives(args.data_dir)
+    print(f"Found {len(archive_paths)} archives in {os.path.abspath(args.data_dir)}")
+
+    index = ArchiveIndex(args.index_path)
+    num_archives, num_files = index_archives(
+        index, archive_paths, args.num_workers, args.reindex
+    )
+    print(f"Indexed {num_files} files from {num_archives} new or changed archives")
+    print(f"Index: {index.stats()}")
+
+    if args.duplicates_output_path:
+        duplicates = [
+            {
+                "hash": digest,
+                "size": size,
+                "occurrences": [
+                    {"extension": extension, "archive": kind, "path": path}
+                    for extension, kind, path in occurrences
+                ],
+            }
+            for digest, size, occurrences in index.duplicates(args.across_extensions)
+        ]
+        write_json_to_file(args.duplicates_output_path, duplicates)
+        print(f"Wrote {len(duplicates)} duplicated files to {args.duplicates_output_path}")
+    index.close()
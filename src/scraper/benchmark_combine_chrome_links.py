@@ -0,0 +1,104 @@
+import os
+import json
+import random
+import resource
+import tempfile
+import time
+import argparse
+from combine_chrome_links import combine_chrome_links
+
+# Benchmarks combine_chrome_links on synthetic extract_chromex slices:
+# github_links.json with N repos, split into fragments of --slice_size repos,
+# of which ~30% have links and ~20% have a manifest but no link. A few repos
+# are repeated in the next slice to exercise link merging.
+
+
+def write_synthetic_inputs(extract_dir, num_repos, slice_size, seed=0):
+    rng = random.Random(seed)
+    repos = [f"https://github.com/owner{i % 997}/repo{i}" for i in range(num_repos)]
+    with open(os.path.join(extract_dir, "github_links.json"), "w") as f:
+        json.dump(repos, f, indent=2)
+
+    for start in range(0, num_repos, slice_size):
+        end = min(start + slice_size, num_repos)
+        with_links, noext = dict(), list()
+        for repo in repos[start:end] + repos[end : end + slice_size // 100]:
+            roll = rng.random()
+            if roll < 0.3:
+                with_links[repo] = [
+                    f"https://chromewebstore.google.com/detail/{rng.randrange(10**6):032d}"
+                    for _ in range(rng.randint(1, 3))
+                ]
+            elif roll < 0.5:
+                noext.append(repo)
+        with open(os.path.join(extract_dir, f"chrome_links_{start}_{end}.json"), "w") as f:
+            json.dump(with_links, f, indent=2)
+        with open(os.path.join(extract_dir, f"chrome_links_noext_{start}_{end}.json"), "w") as f:
+            json.dump(noext, f, indent=2)
+    return repos
+
+
+def legacy_remaining(extract_dir):
+    # The previous list-based remaining computation, O(N * M)
+    combined_links, combined_noext = dict(), list()
+    for filename in os.listdir(extract_dir):
+        with open(os.path.join(extract_dir, filename)) as f:
+            if filename.startswith("chrome_links_noext_"):
+                combined_noext.extend(json.load(f))
+            elif filename.startswith("chrome_links_") and filename[13].isdigit():
+                combined_links.update(json.load(f))
+    combined_noext = list(dict.fromkeys(combined_noext))
+    with open(os.path.join(extract_dir, "github_links.json")) as f:
+        all_repos = json.load(f)
+    return [r for r in all_repos if r not in combined_links and r not in combined_noext]
+
+
+def peak_rss_mib():
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark combine_chrome_links on synthetic inputs"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="Numbers of repos to benchmark",
+    )
+    parser.add_argument(
+        "--slice_size", type=int, default=10_000, help="Repos per fragment"
+    )
+    parser.add_argument(
+        "--legacy_max",
+        type=int,
+        default=20_000,
+        help="Also time the old list-based merge up to this many repos",
+    )
+    args = parser.parse_args()
+
+    print(f"{'repos':>10} {'combine (s)':>12} {'legacy (s)':>11} {'peak RSS (MiB)':>15}")
+    for num_repos in args.sizes:
+        with tempfile.TemporaryDirectory() as extract_dir:
+            write_synthetic_inputs(extract_dir, num_repos, args.slice_size)
+
+            legacy_seconds = "-"
+            if num_repos <= args.legacy_max:
+                started = time.perf_counter()
+                legacy_remaining(extract_dir)
+                legacy_seconds = f"{time.perf_counter() - started:.2f}"
+
+            started = time.perf_counter()
+            with open(os.devnull, "w") as devnull:
+                stdout = os.dup(1)
+                os.dup2(devnull.fileno(), 1)
+                try:
+                    combine_chrome_links(extract_dir)
+                finally:
+                    os.dup2(stdout, 1)
+                    os.close(stdout)
+            seconds = time.perf_counter() - started
+        print(f"{num_repos:>10} {seconds:>12.2f} {legacy_seconds:>11} {peak_rss_mib():>15.0f}")
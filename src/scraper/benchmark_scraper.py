@@ -0,0 +1,376 @@
+import os
+import json
+import time
+import asyncio
+import aiohttp
+import argparse
+import resource
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import extract_chromex
+import cws_page_fetcher
+from scrape_repos import HEADERS, get_params
+from extract_chromex import fetch_and_extract_batch, plan_batch_size, run_workers
+from cws_page_fetcher import PARSER_BACKENDS, parse_metadata, scrape_extension_async
+from adaptive_concurrency import AIMDController
+from rate_limit import RateLimitGovernor, TokenPool
+from mock_servers import (
+    FIXTURES_DIR,
+    Faults,
+    mock_extension_id,
+    start_mock_servers,
+    stop_mock_servers,
+)
+from metrics import metrics
+from utils import HttpClient, fetch_with_rety, read_html_file, write_json_to_file
+
+# Benchmarks each scraper stage against local mock GitHub and Chrome Web
+# Store servers, so throughput can be compared between changes without
+# spending API quota:
+# - search: search result pages through fetch_with_rety
+# - graphql: repo batches through fetch_and_extract_batch
+# - cws: extension pages through scrape_extension_async
+# - parse-<backend>: fixture pages through each parser backend, without network
+# Each stage runs in its own process, so its CPU time, peak RSS and metrics
+# are its own.
+STAGES = ["search", "graphql", "cws"] + [f"parse-{backend}" for backend in PARSER_BACKENDS]
+
+# Seconds the current operation spent waiting for its rate limit, in a
+# one-element list shared with the tasks the operation starts
+rate_limit_wait = contextvars.ContextVar("rate_limit_wait", default=None)
+
+
+class TimedWaits:
+    # Wraps a RateLimitGovernor or TokenPool and adds the time each wait
+    # takes to the operation it is made for, so operation latencies can
+    # leave it out
+    def __init__(self, governor):
+        self.governor = governor
+
+    def add(self, started):
+        waited = rate_limit_wait.get()
+        if waited is not None:
+            waited[0] += time.perf_counter() - started
+
+    def wait(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.governor.wait(*args, **kwargs)
+        finally:
+            self.add(started)
+
+    async def wait_async(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self.governor.wait_async(*args, **kwargs)
+        finally:
+            self.add(started)
+
+    def __getattr__(self, name):
+        return getattr(self.governor, name)
+
+
+def timed(function, *args):
+    # Returns (seconds, error) of one operation, not counting rate limit waits
+    waited = [0.0]
+    token = rate_limit_wait.set(waited)
+    started = time.perf_counter()
+    try:
+        function(*args)
+        return time.perf_counter() - started - waited[0], None
+    except Exception as e:
+        return time.perf_counter() - started - waited[0], e
+    finally:
+        rate_limit_wait.reset(token)
+
+
+async def timed_async(coroutine):
+    waited = [0.0]
+    token = rate_limit_wait.set(waited)
+    started = time.perf_counter()
+    try:
+        result = await coroutine
+        return time.perf_counter() - started - waited[0], None, result
+    except Exception as e:
+        return time.perf_counter() - started - waited[0], e, None
+    finally:
+        rate_limit_wait.reset(token)
+
+
+def bench_search(args, github_url, webstore_url):
+    url = f"{github_url}/search/repositories"
+    client = HttpClient(pool_size=args.workers, headers=HEADERS)
+    governor = TimedWaits(RateLimitGovernor())
+    # 10 pages of 100 results per query, as GitHub caps a search at 1000
+    pages = [(f"bench size:{i // 10}", i % 10 + 1) for i in range(args.search_pages)]
+
+    def fetch(query, page):
+        fetch_with_rety(url, get_params(query, page), governor=governor, client=client)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        return list(executor.map(lambda item: timed(fetch, *item), pages))
+
+
+def bench_graphql(args, github_url, webstore_url):
+    extract_chromex.GRAPHQL_URL = f"{github_url}/graphql"
+    token_pool = TimedWaits(TokenPool(["benchmark-token"]))
+    repo_urls = [f"https://github.com/owner{n}/repo{n}" for n in range(args.graphql_repos)]
+    batch_size = plan_batch_size(args.batch_size)
+    batches = [repo_urls[i : i + batch_size] for i in range(0, len(repo_urls), batch_size)]
+    timings = list()
+
+    async def process(batch):
+        seconds, error, results = await timed_async(
+            fetch_and_extract_batch(session, batch, pool=token_pool)
+        )
+        if error is None and any(status == "error" for _, status, _, _ in results):
+            error = "repos failed"
+        timings.append((seconds, error))
+        return results or []
+
+    async def run():
+        nonlocal session
+        async with aiohttp.ClientSession() as session:
+            await run_workers(batches, process, lambda results: None, args.workers)
+
+    session = None
+    asyncio.run(run())
+    return timings
+
+
+def bench_cws(args, github_url, webstore_url):
+    cws_page_fetcher.CWS_DETAIL_URL = f"{webstore_url}/detail"
+    ext_ids = [mock_extension_id(n) for n in range(args.cws_extensions)]
+    controller = AIMDController(ceiling=args.workers) if args.adaptive else None
+    timings = list()
+
+    async def run(parse_executor):
+        queue = asyncio.Queue(maxsize=args.workers * 2)
+        connector = aiohttp.TCPConnector(limit=args.workers)
+
+        async def worker(session):
+            while True:
+                ext_id = await queue.get()
+                if ext_id is None:
+                    return
+                seconds, _, (_, _, error) = await timed_async(
+                    scrape_extension_async(
+                        session, parse_executor, ext_id, args.parser, controller
+                    )
+                )
+                timings.append((seconds, error))
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            workers = [asyncio.create_task(worker(session)) for _ in range(args.workers)]
+            for ext_id in ext_ids:
+                await queue.put(ext_id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+    with ProcessPoolExecutor() as parse_executor:
+        asyncio.run(run(parse_executor))
+    return timings
+
+
+def bench_parse(backend):
+    def bench(args, github_url, webstore_url):
+        pages = [
+            read_html_file(os.path.join(FIXTURES_DIR, filename))
+            for filename in sorted(os.listdir(FIXTURES_DIR))
+            if filename.endswith(".html")
+        ]
+        return [
+            timed(parse_metadata, pages[i % len(pages)], backend)
+            for i in range(args.parse_pages)
+        ]
+
+    return bench
+
+
+BENCHMARKS = {
+    "search": bench_search,
+    "graphql": bench_graphql,
+    "cws": bench_cws,
+    **{f"parse-{backend}": bench_parse(backend) for backend in PARSER_BACKENDS},
+}
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def counter_total(snapshot, name, include=lambda labels: True):
+    return sum(
+        series["value"]
+        for series in snapshot["counters"].get(name, [])
+        if include(series["labels"])
+    )
+
+
+def is_error_status(labels):
+    # timeouts and connection errors are labelled by name, not status
+    status = labels["status"]
+    return status.isdigit() and int(status) >= 400
+
+
+def run_stage(stage, args, github_url, webstore_url, results):
+    started = time.perf_counter()
+    cpu_started = cpu_seconds(resource.getrusage(resource.RUSAGE_SELF))
+    timings = BENCHMARKS[stage](args, github_url, webstore_url)
+    seconds = time.perf_counter() - started
+
+    # parse workers have exited by now, so their usage is in RUSAGE_CHILDREN
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = cpu_seconds(usage) - cpu_started + cpu_seconds(children)
+    latencies = sorted(latency for latency, _ in timings)
+    snapshot = metrics.snapshot()
+    results.put(
+        {
+            "stage": stage,
+            "ops": len(timings),
+            # operations that failed, after retries
+            "errors": sum(1 for _, error in timings if error is not None),
+            # HTTP error responses, including those that were retried
+            "error_responses": counter_total(snapshot, "http_requests_total", is_error_status),
+            "rate_limit_wait_seconds": counter_total(snapshot, "rate_limit_wait_seconds_total"),
+            "seconds": seconds,
+            "ops_per_second": len(timings) / seconds if seconds > 0 else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "cpu_seconds": cpu,
+            "cpu_percent": 100 * cpu / seconds if seconds > 0 else 0.0,
+            # ru_maxrss is reported in KiB on Linux
+            "peak_rss_mib": max(usage.ru_maxrss, children.ru_maxrss) / 1024,
+        }
+    )
+
+
+def print_results(rows, baseline=None):
+    baseline = {row["stage"]: row for row in baseline or []}
+    print(
+        f"{'stage':<12} {'ops':>6} {'errors':>6} {'err resp':>8} {'ops/s':>9} "
+        f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'wait (s)':>8} {'CPU (s)':>8} {'CPU %':>6} "
+        f"{'RSS (MiB)':>10} {'vs base':>8}"
+    )
+    for row in rows:
+        change = "-"
+        base = baseline.get(row["stage"])
+        if base and base["ops_per_second"]:
+            change = f"{row['ops_per_second'] / base['ops_per_second'] - 1:+.0%}"
+        print(
+            f"{row['stage']:<12} {row['ops']:>6} {row['errors']:>6} "
+            f"{row['error_responses']:>8} {row['ops_per_second']:>9.1f} "
+            f"{row['p50_ms']:>9.1f} {row['p99_ms']:>9.1f} "
+            f"{row['rate_limit_wait_seconds']:>8.1f} {row['cpu_seconds']:>8.2f} "
+            f"{row['cpu_percent']:>6.0f} {row['peak_rss_mib']:>10.0f} {change:>8}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scraper stages against local mock servers"
+    )
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=10, help="Concurrent requests per stage"
+    )
+    parser.add_argument(
+        "--search_pages", type=int, default=200, help="Search pages to fetch"
+    )
+    parser.add_argument(
+        "--graphql_repos", type=int, default=2000, help="Repos to extract"
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=25, help="Repos per GraphQL query"
+    )
+    parser.add_argument(
+        "--cws_extensions", type=int, default=500, help="Extension pages to scrape"
+    )
+    parser.add_argument(
+        "--parse_pages", type=int, default=200, help="Fixture pages to parse per backend"
+    )
+    parser.add_argument(
+        "--parser", choices=PARSER_BACKENDS, default="bs4", help="Parser of the cws stage"
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Gate the cws stage with the AIMD concurrency controller",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="Server latency in seconds"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Extra random latency of up to this many seconds"
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Share of requests the servers answer with a 502 (GitHub) or 503 (Web Store)",
+    )
+    parser.add_argument(
+        "--rate_limit",
+        type=int,
+        default=100_000,
+        help="Mock GitHub requests per rate limit window; exhausting it returns 403s",
+    )
+    parser.add_argument(
+        "--rate_window", type=int, default=60, help="Rate limit window in seconds"
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Write the results to this json file"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Results json of an earlier run to compare ops/s against",
+    )
+    args = parser.parse_args()
+
+    faults = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    server, github_url, webstore_url = start_mock_servers(
+        github_options=dict(
+            num_repos=max(args.graphql_repos, 1000),
+            rate_limit=args.rate_limit,
+            rate_window=args.rate_window,
+            num_extensions=max(args.cws_extensions, 1),
+            faults=Faults(**faults),
+        ),
+        webstore_options=dict(faults=Faults(error_status=503, **faults)),
+    )
+    rows = list()
+    try:
+        for stage in args.stages:
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=run_stage, args=(stage, args, github_url, webstore_url, results)
+            )
+            process.start()
+            rows.append(results.get())
+            process.join()
+    finally:
+        stop_mock_servers(server)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(rows, baseline)
+    if args.output:
+        write_json_to_file(args.output, rows)
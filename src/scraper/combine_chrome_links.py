@@ -1,55 +1,63 @@
 import os
+import re
 import sys
 import json
 import glob
+from journal import JobJournal, write_json_stream
+from utils import read_json_file
+
+# chrome_links[_<input list>]_<start>_<end>.json
+FRAGMENT_RE = re.compile(r"(?P<stem>.*)_(?P<start>\d+)_(?P<end>\d+)\.json")
+
+
+def fragment_order(filepath: str):
+    # Slices of each input list in index order, so links keep the order in
+    # which their repos were first seen. Only the trailing start and end are
+    # indexes: digits in an input list's name (e.g. a timestamp) are not.
+    filename = os.path.basename(filepath)
+    match = FRAGMENT_RE.fullmatch(filename)
+    if not match:
+        return filename, 0, 0
+    return match["stem"], int(match["start"]), int(match["end"])
+
+
+def read_fragment(filepath: str):
+    # A fragment with invalid JSON (e.g. a slice that was still being
+    # written) is skipped as a whole
+    try:
+        return read_json_file(filepath)
+    except json.JSONDecodeError:
+        print(f"Warning: skipping invalid JSON {os.path.basename(filepath)}")
+        return {}
 
 
 def combine_chrome_links(extract_dir: str) -> None:
-    # Combine chrome_links batches 
-    combined_links: dict[str, list[str]] = {}
+    # Combine chrome_links batches. Each repo's links are kept in a dict used
+    # as an ordered set, so merging is linear in the total number of links.
+    combined_links: dict[str, dict[str, None]] = {}
     links_pattern = os.path.join(extract_dir, "chrome_links_*_*.json")
-    for filepath in glob.glob(links_pattern):
+    for filepath in sorted(glob.glob(links_pattern), key=fragment_order):
         filename = os.path.basename(filepath)
         if filename in ("chrome_links.json", "chrome_links_noext.json"): continue
         if filename.startswith("chrome_links_noext_"): continue
-        with open(filepath, 'r') as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Warning: skipping invalid JSON {filename}")
-                continue
-        for repo, links in data.items():
-            if repo in combined_links:
-                seen = set(combined_links[repo])
-                for link in links:
-                    if link not in seen:
-                        combined_links[repo].append(link)
-                        seen.add(link)
-            else:
-                combined_links[repo] = list(links)
+        for repo, links in read_fragment(filepath).items():
+            combined_links.setdefault(repo, {}).update(dict.fromkeys(links))
 
     # Combine chrome_links_noext batches 
-    combined_noext: list[str] = []
+    combined_noext: dict[str, None] = {}
     noext_pattern = os.path.join(extract_dir, "chrome_links_noext_*_*.json")
-    for filepath in glob.glob(noext_pattern):
+    for filepath in sorted(glob.glob(noext_pattern), key=fragment_order):
         filename = os.path.basename(filepath)
         if filename in ("chrome_links_noext.json", "chrome_links.json"): continue
-        with open(filepath, 'r') as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Warning: skipping invalid JSON {filename}")
-                continue
-        combined_noext.extend(data)
-    combined_noext = list(dict.fromkeys(combined_noext))
+        combined_noext.update(dict.fromkeys(read_fragment(filepath)))
 
     # Write combined outputs 
     out_links = os.path.join(extract_dir, "chrome_links.json")
     out_noext = os.path.join(extract_dir, "chrome_links_noext.json")
     with open(out_links, 'w') as f:
-        json.dump(combined_links, f, indent=2)
+        json.dump({repo: list(links) for repo, links in combined_links.items()}, f, indent=2)
     with open(out_noext, 'w') as f:
-        json.dump(combined_noext, f, indent=2)
+        json.dump(list(combined_noext), f, indent=2)
 
     print(f"Combined chrome_links.json entries: {len(combined_links)} repos")
     print(f"Combined chrome_links_noext.json entries: {len(combined_noext)} repos")
@@ -57,19 +65,23 @@ def combine_chrome_links(extract_dir: str) -> None:
     # Determine remaining repos
     github_links_file = os.path.join(extract_dir, 'github_links.json')
     if os.path.isfile(github_links_file):
-        with open(github_links_file, 'r') as f:
-            try:
-                all_repos = json.load(f)
-            except json.JSONDecodeError:
-                print(f"Warning: could not parse {github_links_file}")
-                return
-        # repos not in either combined set
-        remaining = [r for r in all_repos if r not in combined_links and r not in combined_noext]
-        # write remaining file
+        try:
+            all_repos = read_json_file(github_links_file)
+        except json.JSONDecodeError:
+            print(f"Warning: could not parse {github_links_file}")
+            return
+        # repos not in either combined set, written as they are found
         out_remaining = os.path.join(extract_dir, 'chrome_links_remaining.json')
-        with open(out_remaining, 'w') as f:
-            json.dump(remaining, f, indent=2)
-        print(f"Remaining repos (not in chrome_links or chrome_links_noext): {len(remaining)} entries")
+        remaining = write_json_stream(
+            out_remaining,
+            (
+                (r,)
+                for r in all_repos
+                if r not in combined_links and r not in combined_noext
+            ),
+            as_dict=False,
+        )
+        print(f"Remaining repos (not in chrome_links or chrome_links_noext): {remaining} entries")
     else:
         print(f"No github_links.json found in {extract_dir}, skipping remaining list.")
 
@@ -80,7 +92,13 @@ def main():
     if not os.path.isdir(extract_dir):
         print(f"Error: directory not found: {extract_dir}")
         return
-    combine_chrome_links(extract_dir)
+    journal_path = os.path.join(extract_dir, 'chrome_links.sqlite3')
+    if os.path.isfile(journal_path):
+        # extract_chromex journal runs: write the outputs from the journal
+        for filename, count in JobJournal(journal_path).materialize(extract_dir).items():
+            print(f"Combined {filename} entries: {count} repos")
+    else:
+        combine_chrome_links(extract_dir)
     print(f"Combined JSON files saved in {extract_dir}:")
     print("  - chrome_links.json")
     print("  - chrome_links_noext.json")
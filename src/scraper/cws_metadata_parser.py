@@ -0,0 +1,155 @@
+import re
+from html.parser import HTMLParser
+
+# Elements that never have an end tag (as treated by BeautifulSoup)
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen",
+    "link", "menuitem", "meta", "param", "source", "track", "wbr", "basefont",
+    "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer",
+}
+# Elements whose text BeautifulSoup's get_text() leaves out
+HIDDEN_TEXT_ELEMENTS = {"script", "style", "template"}
+
+# field -> (tag, class test) of the element the DOM extractors look up
+TARGETS = {
+    "user_count": ("div", lambda classes: "F9iKBc" in classes.split()),
+    "rating": ("span", lambda classes: "Vq0ZA" in classes.split()),
+    "rating_count": ("p", lambda classes: "xJEoWe" in classes.split()),
+    "version": ("div", lambda classes: "N3EXSc" in classes.split()),
+    "size": ("li", lambda classes: classes == "ZbWJPd ZSMSLb"),
+    "overview": ("div", lambda classes: "RNnO5e" in classes.split()),
+}
+
+
+# Text of a page element -> metadata value, shared by every parser backend
+# so they agree on the values they return; None when the text has no value
+def parse_user_count(text):
+    match = re.search(r"([\d,]+) user[s]?", text or "")
+    return int(match.group(1).replace(",", "")) if match else None
+
+
+def parse_rating(text):
+    match = re.search(r"([\d.]+)", text or "")
+    return float(match.group(1)) if match else None
+
+
+def parse_rating_count(text):
+    # "123 ratings", "1.2K ratings"
+    match = re.search(r"(\d+(\.\d)?[K]?) rating[s]?", text or "")
+    if not match:
+        return None
+    matched_rating_count = match.group(1)
+    if "K" in matched_rating_count:
+        return int(float(matched_rating_count.replace("K", "")) * 1000)
+    return int(matched_rating_count)
+
+
+def parse_version(text):
+    return text.strip() if text is not None else None
+
+
+def parse_size(text):
+    return text.strip() if text is not None else None
+
+
+def parse_overview(text):
+    return re.sub(r"\s+", "", text) if text is not None else None
+
+
+class StopParsing(Exception):
+    pass
+
+
+class Capture:
+    def __init__(self, field, depth):
+        self.field = field
+        self.depth = depth
+        self.parts = []
+        # size: text of each direct child element of the <li>
+        self.children = []
+
+
+# Collects the text of the first element matching each target in a single
+# pass over the page, without building a tree, and stops as soon as all of
+# them are closed.
+class MetadataParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.captures = []
+        self.texts = dict()
+
+    def handle_starttag(self, tag, attrs):
+        classes = dict(attrs).get("class") or ""
+        for field, (target_tag, matches) in TARGETS.items():
+            if (
+                tag == target_tag
+                and field not in self.texts
+                and not any(c.field == field for c in self.captures)
+                and matches(classes)
+            ):
+                self.captures.append(Capture(field, len(self.stack)))
+        for capture in self.captures:
+            if capture.field == "size" and len(self.stack) == capture.depth + 1:
+                capture.children.append([])
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        # like BeautifulSoup, close everything up to the most recent match
+        while self.stack:
+            closed = self.stack.pop()
+            for capture in [c for c in self.captures if c.depth == len(self.stack)]:
+                self.captures.remove(capture)
+                self.texts[capture.field] = capture
+            if closed == tag:
+                break
+        if len(self.texts) == len(TARGETS):
+            raise StopParsing()
+
+    def handle_data(self, data):
+        if any(tag in HIDDEN_TEXT_ELEMENTS for tag in self.stack):
+            return
+        for capture in self.captures:
+            capture.parts.append(data)
+            if capture.children and len(self.stack) > capture.depth + 1:
+                capture.children[-1].append(data)
+
+
+def parse_fields(page: str):
+    parser = MetadataParser()
+    try:
+        parser.feed(page)
+        parser.close()
+    except StopParsing:
+        pass
+    return parser.texts
+
+
+def extract_metadata_fast(page: str):
+    captures = parse_fields(page)
+
+    def text(field):
+        capture = captures.get(field)
+        return "".join(capture.parts) if capture else None
+
+    size_text = None
+    size_capture = captures.get("size")
+    if size_capture and len(size_capture.children) == 2:
+        size_text = "".join(size_capture.children[1])
+
+    metadata = dict()
+    metadata["user_count"] = parse_user_count(text("user_count"))
+    metadata["rating"] = parse_rating(text("rating"))
+    metadata["rating_count"] = parse_rating_count(text("rating_count"))
+    metadata["version"] = parse_version(text("version"))
+    metadata["size"] = parse_size(size_text)
+    metadata["overview"] = parse_overview(text("overview"))
+    return metadata
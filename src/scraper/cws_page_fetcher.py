@@ -1,23 +1,54 @@
 from bs4 import BeautifulSoup
 import argparse
+import asyncio
+import aiohttp
+import os
+import json
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from utils import (
+    HttpClient,
     fetch_with_rety,
+    fetch_with_rety_async,
     read_json_file,
     write_json_to_file,
     print_progress,
     logger,
 )
+from http_cache import HttpCache, DEFAULT_TTL
+from cws_metadata_parser import (
+    extract_metadata_fast,
+    parse_user_count,
+    parse_rating,
+    parse_rating_count,
+    parse_version,
+    parse_size,
+    parse_overview,
+)
+from adaptive_concurrency import AIMDController
+from metrics import metrics
+
+CWS_DETAIL_URL = "https://chromewebstore.google.com/detail"
+
+# Optional on-disk response cache, enabled with --cache_path
+http_cache = None
+# Pooled keep-alive client shared by the scraping threads, set up in main
+http_client = None
 
 
-def extract_html(url: str):
-    response = fetch_with_rety(url, params=None, headers=None)
+def fetch_page(url: str):
+    response = fetch_with_rety(
+        url, params=None, headers=None, cache=http_cache, client=http_client
+    )
 
     if response.status_code != 200:
         raise Exception(f"Failed to fetch page: {response.status_code}")
 
-    page = response.text
+    return response.text
+
+
+def parse_html(page: str):
     soup = BeautifulSoup(page, "html.parser")
     for script in soup.find_all("script"):
         script.decompose()
@@ -25,48 +56,50 @@ def extract_html(url: str):
     return body
 
 
+# Parser backends: "bs4" builds the full BeautifulSoup tree, "fast" collects
+# only the six fields in a single streaming pass (see cws_metadata_parser.py)
+PARSER_BACKENDS = ["bs4", "fast"]
+
+
+def parse_metadata(page: str, backend: str = "bs4"):
+    # Runs in a worker process, so it takes and returns plain (picklable) data
+    if backend == "fast":
+        return extract_metadata_fast(page)
+    return extract_metadata(parse_html(page))
+
+
+def parse_metadata_timed(page: str, backend: str = "bs4"):
+    # parse_metadata and its duration, timed inside the worker process so
+    # the time spent queued for a worker is not counted
+    started = time.perf_counter()
+    metadata = parse_metadata(page, backend)
+    return metadata, time.perf_counter() - started
+
+
+# Text of the first element matching tag and class_, or None
+def element_text(soup, tag, class_):
+    element = soup.find(tag, class_=class_)
+    return element.get_text() if element else None
+
+
 def extract_users(soup):
     user_count_div_class = "F9iKBc"
-    user_count_div = soup.find("div", class_=user_count_div_class)
-    if user_count_div:
-        inner_text = user_count_div.get_text()
-        match = re.search(r"([\d,]+) user[s]?", inner_text)
-        if match:
-            return int(match.group(1).replace(",", ""))
-    return None
+    return parse_user_count(element_text(soup, "div", user_count_div_class))
 
 
 def extract_rating(soup):
     rating_span_class = "Vq0ZA"
-    rating_span = soup.find("span", class_=rating_span_class)
-    if rating_span:
-        inner_text = rating_span.get_text()
-        match = re.search(r"([\d.]+)", inner_text)
-        if match:
-            return float(match.group(1))
-    return None
+    return parse_rating(element_text(soup, "span", rating_span_class))
 
 
 def extract_rating_count(soup):
     rating_count_p_class = "xJEoWe"
-    rating_count_p = soup.find("p", class_=rating_count_p_class)
-    if rating_count_p:
-        inner_text = rating_count_p.get_text()
-        match = re.search(r"(\d+(\.\d)?[K]?) rating[s]?", inner_text)
-        if match:
-            matched_rating_count = match.group(1)
-            if "K" in matched_rating_count:
-                return int(float(matched_rating_count.replace("K", "")) * 1000)
-            else:
-                return int(matched_rating_count)
-    return None
+    return parse_rating_count(element_text(soup, "p", rating_count_p_class))
 
 
 def extract_version(soup):
     version_div_class = "N3EXSc"
-    version_div = soup.find("div", class_=version_div_class)
-    if version_div:
-        return version_div.get_text().strip()
+    return parse_version(element_text(soup, "div", version_div_class))
 
 
 def extract_size(soup):
@@ -75,18 +108,13 @@ def extract_size(soup):
     if size_li:
         size_li_chilren = size_li.find_all(recursive=False)
         if len(size_li_chilren) == 2:
-            size_div = size_li_chilren[1]
-            if size_div:
-                return size_div.get_text().strip()
+            return parse_size(size_li_chilren[1].get_text())
+    return None
 
 
 def extract_overview(soup):
     overview_div_class = "RNnO5e"
-    overview_div = soup.find("div", class_=overview_div_class)
-    if overview_div:
-        overview_text = overview_div.get_text()
-        return re.sub(r"\s+", "", overview_text)
-    return None
+    return parse_overview(element_text(soup, "div", overview_div_class))
 
 
 def extract_metadata(soup):
@@ -100,30 +128,252 @@ def extract_metadata(soup):
     return metadata
 
 
-def scrape_repo(repo_url: str, cws_urls: str):
+def scrape_extension(extension_id: str, backend: str = "bs4"):
+    try:
+        page = fetch_page(canonical_cws_url(extension_id))
+        with metrics.timer("parse_seconds", parser=backend):
+            metadata = parse_metadata(page, backend)
+        metrics.inc("items_total", stage="cws")
+        return extension_id, metadata, None
+    except Exception as e:
+        logger.error(f"Failed to fetch {extension_id}: {e}")
+        return extension_id, None, f"Scrape error: {str(e)}"
+
+
+async def scrape_extension_async(
+    session,
+    parse_executor,
+    extension_id: str,
+    backend: str = "bs4",
+    controller=None,
+    cache=None,
+):
+    loop = asyncio.get_running_loop()
+    try:
+        cws_url = canonical_cws_url(extension_id)
+        page = await fetch_with_rety_async(
+            session,
+            cws_url,
+            cache=http_cache if cache is None else cache,
+            controller=controller,
+        )
+        metadata, parse_seconds = await loop.run_in_executor(
+            parse_executor, parse_metadata_timed, page, backend
+        )
+        metrics.observe("parse_seconds", parse_seconds, parser=backend)
+        metrics.inc("items_total", stage="cws")
+        return extension_id, metadata, None
+    except Exception as e:
+        logger.error(f"Failed to fetch {extension_id}: {e}")
+        return extension_id, None, f"Scrape error: {str(e)}"
+
+
+def build_scrape_result(repo_url: str, links: dict, store: dict):
+    # links: extension ID -> CWS URL of one repo, store: extension ID ->
+    # (metadata, error); returns the repo's result and failures
     scrape_result = dict()
     scrape_result["repo_url"] = repo_url
     scrape_result["scraped_metadata"] = list()
     failed_urls = list()
-    for cws_url in cws_urls:
-        try:
-            soup = extract_html(cws_url)
-            metadata = extract_metadata(soup)
-            metadata["cws_url"] = cws_url
-            scrape_result["scraped_metadata"].append(metadata)
-        except Exception as e:
-            logger.error(f"Failed to fetch {cws_url}: {e}")
-            failed_urls.append(
-                to_failed_urls_dict(repo_url, cws_url, f"Scrape error: {str(e)}")
+    for ext_id, cws_url in links.items():
+        metadata, error = store[ext_id]
+        if error:
+            failed_urls.append(to_failed_urls_dict(repo_url, cws_url, error))
+        else:
+            scrape_result["scraped_metadata"].append({**metadata, "cws_url": cws_url})
+    return scrape_result, failed_urls
+
+
+class ExtensionFanOut:
+    # Each extension page is scraped once, however many repos link to it.
+    # Results are kept in an extension ID keyed store and fanned back out to
+    # every linking repo; a repo's result is handed to on_result as soon as
+    # all of its extensions are done. An extension's result is dropped once
+    # every repo linking to it has been handed on, unless keep_extensions
+    # is set for extensions().
+    def __init__(self, urls_to_scrape: dict, on_result, keep_extensions=False):
+        self.on_result = on_result
+        self.keep_extensions = keep_extensions
+        self.links_by_repo = dict()
+        self.repos_by_extension = dict()
+        for repo_url, cws_urls in urls_to_scrape.items():
+            links = dict()
+            for cws_url in cws_urls:
+                links.setdefault(extension_id(cws_url), cws_url)
+            self.links_by_repo[repo_url] = links
+            for ext_id in links:
+                self.repos_by_extension.setdefault(ext_id, []).append(repo_url)
+        self.remaining = {
+            repo_url: len(links) for repo_url, links in self.links_by_repo.items()
+        }
+        # extension ID -> repos not yet handed on that link to it
+        self.references = {
+            ext_id: len(repo_urls) for ext_id, repo_urls in self.repos_by_extension.items()
+        }
+        self.store = dict()
+
+    def extension_ids(self):
+        return list(self.repos_by_extension)
+
+    def extension_done(self, ext_id, metadata, error):
+        self.store[ext_id] = (metadata, error)
+        for repo_url in self.repos_by_extension.pop(ext_id):
+            self.remaining[repo_url] -= 1
+            if self.remaining[repo_url] == 0:
+                del self.remaining[repo_url]
+                self.emit(repo_url)
+
+    def emit(self, repo_url):
+        links = self.links_by_repo.pop(repo_url)
+        self.on_result(*build_scrape_result(repo_url, links, self.store))
+        for ext_id in links:
+            self.references[ext_id] -= 1
+            if self.references[ext_id] == 0:
+                del self.references[ext_id]
+                if not self.keep_extensions:
+                    del self.store[ext_id]
+
+    def extensions(self):
+        return {
+            ext_id: metadata
+            for ext_id, (metadata, error) in self.store.items()
+            if error is None
+        }
+
+
+async def scrape_all_async(
+    fan_out,
+    num_workers=10,
+    per_host_limit=None,
+    backend="bs4",
+    controller=None,
+    report_interval=10,
+):
+    # num_workers bounds the requests in flight, per_host_limit bounds the
+    # connections opened to any single host of the shared keep-alive pool.
+    # With an AIMD controller, num_workers is its ceiling and the controller
+    # decides how many of those requests may be in flight at any time.
+    # A worker that dies cancels the task group, producer included.
+    if controller:
+        num_workers = controller.ceiling
+    queue = asyncio.Queue(maxsize=num_workers * 2)
+    connector = aiohttp.TCPConnector(
+        limit=num_workers, limit_per_host=per_host_limit or 0
+    )
+
+    async def worker(session, parse_executor):
+        while True:
+            ext_id = await queue.get()
+            if ext_id is None:
+                return
+            fan_out.extension_done(
+                *await scrape_extension_async(
+                    session, parse_executor, ext_id, backend, controller
+                )
             )
 
-    return (scrape_result, failed_urls)
+    async def reporter():
+        while True:
+            await asyncio.sleep(report_interval)
+            print(f"\n{controller.report()}")
+
+    with ProcessPoolExecutor() as parse_executor:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            reporting = asyncio.create_task(reporter()) if controller else None
+            try:
+                async with asyncio.TaskGroup() as group:
+                    for _ in range(num_workers):
+                        group.create_task(worker(session, parse_executor))
+                    for ext_id in fan_out.extension_ids():
+                        await queue.put(ext_id)
+                    for _ in range(num_workers):
+                        await queue.put(None)
+            finally:
+                if reporting:
+                    reporting.cancel()
 
 
 def to_failed_urls_dict(repo_url: str, cws_url: str, error: str) -> dict:
     return {"repo_url": repo_url, "cws_url": cws_url, "error": error}
 
 
+def filter_scrape_result(scrape_result: dict):
+    # Drops metadata with all None values (presume extension web page is not
+    # available); returns the result, or None if nothing is left, and the
+    # failures for the dropped URLs
+    repo_url = scrape_result["repo_url"]
+    kept = list()
+    failed_urls = list()
+    for cws_metadata in scrape_result["scraped_metadata"]:
+        cws_url = cws_metadata.pop("cws_url")
+        if all(value is None for value in cws_metadata.values()):
+            failed_urls.append(
+                to_failed_urls_dict(repo_url, cws_url, "All metadata is None")
+            )
+        else:
+            kept.append(cws_metadata)
+    scrape_result["scraped_metadata"] = kept
+    return (scrape_result if kept else None), failed_urls
+
+
+def open_for_writing(filepath):
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    return open(filepath, "w")
+
+
+class ResultWriter:
+    # Writes each repo's filtered result and failures. With jsonl, both are
+    # appended as JSON lines as soon as they are written, so the results are
+    # not held in memory and the output written so far survives a crash;
+    # otherwise the JSON files are written on close.
+    def __init__(self, output_path, failed_urls_output_path=None, jsonl=False):
+        self.output_path = output_path
+        self.failed_urls_output_path = failed_urls_output_path
+        self.jsonl = jsonl
+        self.scraped_metadata = list()
+        self.failed_urls = list()
+        # repos written, and those of them with scraped metadata
+        self.repo_count = 0
+        self.scraped_count = 0
+        self.failed_count = 0
+        if jsonl:
+            self.output_file = open_for_writing(output_path)
+            self.failed_urls_file = (
+                open_for_writing(failed_urls_output_path) if failed_urls_output_path else None
+            )
+
+    def write_failed(self, failed):
+        self.failed_count += len(failed)
+        if not self.jsonl:
+            self.failed_urls.extend(failed)
+        elif self.failed_urls_file:
+            for failed_url in failed:
+                self.failed_urls_file.write(json.dumps(failed_url) + "\n")
+            self.failed_urls_file.flush()
+
+    def write(self, scrape_result, failed):
+        self.repo_count += 1
+        scrape_result, all_none = filter_scrape_result(scrape_result)
+        if scrape_result is not None:
+            self.scraped_count += 1
+            if self.jsonl:
+                self.output_file.write(json.dumps(scrape_result) + "\n")
+                self.output_file.flush()
+            else:
+                self.scraped_metadata.append(scrape_result)
+        self.write_failed(failed + all_none)
+
+    def close(self):
+        if self.jsonl:
+            self.output_file.close()
+            if self.failed_urls_file:
+                self.failed_urls_file.close()
+            return
+        write_json_to_file(self.output_path, self.scraped_metadata)
+        if self.failed_urls_output_path:
+            write_json_to_file(self.failed_urls_output_path, self.failed_urls)
+
+
 def clean_urls_to_scrape(urls_to_scrape: dict):
     cleaned = dict()
     failed_urls = list()
@@ -143,6 +393,16 @@ def clean_urls_to_scrape(urls_to_scrape: dict):
     return cleaned, failed_urls
 
 
+def extension_id(cws_url: str):
+    # Old and new Web Store URLs, with or without /u/N/ and a name slug, all
+    # end in the same 32 character extension ID
+    return re.search(r"[a-p]{32}$", cws_url).group()
+
+
+def canonical_cws_url(extension_id: str):
+    return f"{CWS_DETAIL_URL}/{extension_id}"
+
+
 def clean_cws_url(url: str):
     host_pattern = r"https?://(?:chromewebstore.google.com|chrome.google.com/webstore)(?:/u/\d+)?/detail/"
     name_pattern = (
@@ -185,10 +445,88 @@ if __name__ == "__main__":
     parser.add_argument(
         "--num_workers",
         type=int,
-        help="Number of worker threads to use for scraping",
+        help="Number of worker threads to use for scraping (with --async_fetch: number of requests in flight)",
     )
 
+    parser.add_argument(
+        "--extensions_output_path",
+        type=str,
+        help="Output file path to save the scraped metadata keyed by extension ID",
+    )
+
+    parser.add_argument(
+        "--async_fetch",
+        action="store_true",
+        help="Fetch pages with asyncio over a single keep-alive connection pool",
+    )
+
+    parser.add_argument(
+        "--per_host_limit",
+        type=int,
+        help="Maximum concurrent connections per host (only with --async_fetch)",
+    )
+
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        help="SQLite file to cache fetched pages in across runs",
+    )
+
+    parser.add_argument(
+        "--cache_ttl",
+        type=int,
+        default=DEFAULT_TTL,
+        help="Seconds a cached page is used before it is revalidated",
+    )
+
+    parser.add_argument(
+        "--parser",
+        type=str,
+        choices=PARSER_BACKENDS,
+        default="bs4",
+        help="Parser backend used to extract the metadata",
+    )
+
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Adapt the requests in flight to the Web Store's latency and errors (only with --async_fetch); --num_workers is the starting level",
+    )
+
+    parser.add_argument(
+        "--min_concurrency",
+        type=int,
+        default=1,
+        help="Floor of the adaptive concurrency",
+    )
+
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=64,
+        help="Ceiling of the adaptive concurrency",
+    )
+
+    parser.add_argument(
+        "--report_interval",
+        type=int,
+        default=10,
+        help="Seconds between adaptive concurrency reports",
+    )
+
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Append each repo's result (and failures) to the output files as JSON lines as soon as it is scraped",
+    )
+
+    metrics.add_arguments(parser)
+
     args = parser.parse_args()
+    metrics.start_run(args.metrics_path, args.metrics_interval)
+
+    if args.cache_path:
+        http_cache = HttpCache(args.cache_path, ttl=args.cache_ttl)
 
     urls_to_scrape = read_json_file(args.input_path)
 
@@ -198,45 +536,55 @@ if __name__ == "__main__":
     total_urls = sum(len(cws_urls) for cws_urls in urls_to_scrape.values())
     print(f"Scraping {total_urls} URLS...")
 
-    scraped_metadata = list()
-
     max_workers = args.num_workers if args.num_workers else 10
+    http_client = HttpClient(pool_size=max_workers)
 
-    completed = 0
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(scrape_repo, repo_url, cws_urls)
-            for repo_url, cws_urls in urls_to_scrape.items()
-        ]
-        for future in as_completed(futures):
-            metadata, failed = future.result()
-            scraped_metadata.append(metadata)
-            failed_urls += failed
-            completed += 1
-            print_progress(completed, len(urls_to_scrape))
-    print()
+    writer = ResultWriter(args.output_path, args.failed_urls_output_path, args.jsonl)
+    writer.write_failed(failed_urls)
 
-    # Remove metadata with all None values (presume extention web page is not availabel)
-    for metadata in scraped_metadata.copy():
-        repo_url = metadata["repo_url"]
+    def on_result(metadata, failed):
+        writer.write(metadata, failed)
+        print_progress(writer.repo_count, len(urls_to_scrape))
 
-        for cws_metadata in metadata["scraped_metadata"].copy():
-            cws_url = cws_metadata["cws_url"]
-            del cws_metadata["cws_url"]
-            is_all_none = all(value is None for value in cws_metadata.values())
-            if is_all_none:
-                failed_urls.append(
-                    to_failed_urls_dict(repo_url, cws_url, "All metadata is None")
-                )
-                metadata["scraped_metadata"].remove(cws_metadata)
-
-        if len(metadata["scraped_metadata"]) == 0:
-            scraped_metadata.remove(metadata)
+    fan_out = ExtensionFanOut(
+        urls_to_scrape, on_result, keep_extensions=bool(args.extensions_output_path)
+    )
+    print(f"Scraping {len(fan_out.extension_ids())} unique extensions...")
+
+    if args.async_fetch:
+        controller = None
+        if args.adaptive:
+            controller = AIMDController(
+                initial=max_workers,
+                floor=args.min_concurrency,
+                ceiling=args.max_concurrency,
+            )
+        asyncio.run(
+            scrape_all_async(
+                fan_out,
+                num_workers=max_workers,
+                per_host_limit=args.per_host_limit,
+                backend=args.parser,
+                controller=controller,
+                report_interval=args.report_interval,
+            )
+        )
+        if controller:
+            print(f"\n{controller.summary()}")
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(scrape_extension, ext_id, args.parser)
+                for ext_id in fan_out.extension_ids()
+            ]
+            for future in as_completed(futures):
+                fan_out.extension_done(*future.result())
+    print()
 
-    write_json_to_file(args.output_path, scraped_metadata)
+    if args.extensions_output_path:
+        write_json_to_file(args.extensions_output_path, fan_out.extensions())
 
-    if args.failed_urls_output_path:
-        write_json_to_file(args.failed_urls_output_path, failed_urls)
+    writer.close()
 
-    print(f"Scraping completed! {len(scraped_metadata)} URLs scraped successfully.")
-    print(f"Failed URLs: {len(failed_urls)}")
+    print(f"Scraping completed! {writer.scraped_count} URLs scraped successfully.")
+    print(f"Failed URLs: {writer.failed_count}")
@@ -4,22 +4,29 @@ import json
 import asyncio
 import aiohttp
 import re
+import time
 from urllib.parse import urlparse
 from typing import List, Optional, Tuple
+from rate_limit import TokenPool, load_github_tokens, is_rate_limited
+from journal import JobJournal, DONE, NO_MANIFEST, NO_LINK, ERROR
+from utils import read_json_file
+from metrics import metrics, host_of
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SECRET_PATH = os.path.join(BASE_DIR, "secret.json")
 LINKS_PATH = os.path.join(BASE_DIR, "extracted_urls", "github_links.json")
+JOURNAL_PATH = os.path.join(BASE_DIR, "extracted_urls", "chrome_links.sqlite3")
 
-# Load GitHub token
-with open(SECRET_PATH) as f:
-    token = json.load(f)["github_access_token"]
 HEADERS = {
-    "Authorization": f"token {token}",
     "Content-Type": "application/json"
 }
 
+# GitHub tokens from secret.json, loaded in main(). Each GraphQL request is
+# routed to the token with the most budget left and paced against the
+# X-RateLimit-* response headers.
+token_pool: Optional[TokenPool] = None
+
 # Regex to find Chrome Web Store links
 CHROME_LINK_RE = re.compile(
     r'https?://(?:chrome\.google\.com/webstore/detail/[^\s)]+|chromewebstore\.google\.com/[^\s)]+)'
@@ -40,112 +47,309 @@ def repo_from_url(url: str) -> Tuple[str, str]:
         raise ValueError(f"Invalid GitHub URL: {url}")
     return parts[0], parts[1]
 
-# GraphQL query for manifest and README entries
-GQL_QUERY = """
-query($owner:String!,$name:String!){
-  repository(owner:$owner,name:$name){
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+# Phase one fields: root entry names and sizes plus manifest presence
+REPO_FIELDS = """
+    defaultBranchRef { target { oid } }
     manifest: object(expression: "HEAD:manifest.json") { ... on Blob { byteSize } }
     root: object(expression: "HEAD:") {
-      ... on Tree { entries { name object { ... on Blob { text } } } }
+      ... on Tree { entries { name object { ... on Blob { byteSize } } } }
     }
-  }
-}
 """
 
+# Only the default branch HEAD, to find repos that changed since last run
+OID_FIELDS = "defaultBranchRef { target { oid } }"
+
+# Phase two only downloads README blobs up to this many bytes
+DEFAULT_MAX_README_BYTES = 512 * 1024
+
+# Neither query selects a paginated connection, so each costs the minimum
+# of one point whatever the batch size; very large queries hit the 10
+# second server timeout instead, so batches are capped at MAX_BATCH_SIZE
+MAX_BATCH_SIZE = 100
+
 # Extract Chrome Web Store links from text
 def extract_links_from_text(text: str) -> List[str]:
     return list(dict.fromkeys(CHROME_LINK_RE.findall(text)))
 
-# Handle rate limit exceeded and exit
-def handle_rate_limit(resp: aiohttp.ClientResponse, repo_url: str):
-    if resp.status == 403 and resp.headers.get("X-RateLimit-Remaining") == "0":
-        reset = resp.headers.get("X-RateLimit-Reset")
-        print(f"\nRate limit reached for {repo_url}, reset at {reset}")
-        sys.exit(1)
+# README-like root entries small enough to download in phase two
+def readme_paths(repo_data: dict, max_readme_bytes: int) -> List[str]:
+    paths = []
+    for entry in (repo_data.get("root") or {}).get("entries", []):
+        name = entry.get("name", "")
+        blob = entry.get("object") or {}
+        if name.lower().startswith("readme") and 0 < blob.get("byteSize", 0) <= max_readme_bytes:
+            paths.append(name)
+    return paths
 
-# Fetch manifest and README via GraphQL and extract links
-async def fetch_and_extract(session: aiohttp.ClientSession, repo_url: str) -> Tuple[str, Optional[List[str]]]:
-    owner, name = repo_from_url(repo_url)
-    payload = {"query": GQL_QUERY, "variables": {"owner": owner, "name": name}}
-    async with session.post("https://api.github.com/graphql", json=payload, headers=HEADERS) as resp:
-        handle_rate_limit(resp, repo_url)
-        if resp.status != 200:
-            print(f"HTTP {resp.status} for {repo_url}")
-            return repo_url, None
-        data = await resp.json()
-        if "errors" in data:
-            for err in data["errors"]:
-                if err.get("type") == "RATE_LIMITED":
-                    reset = resp.headers.get("X-RateLimit-Reset")
-                    print(f"Rate limit reached for {repo_url}, reset at {reset}")
-                    sys.exit(1)
-            return repo_url, None
-        repo_data = data.get("data", {}).get("repository", {})
+# Extract links from README texts (in root order) and the manifest homepage
+def links_from_blobs(readme_texts: List[str], manifest_text: Optional[str] = None) -> List[str]:
+    links = []
+    for text in readme_texts:
+        links = extract_links_from_text(text or "")
+        if links:
+            break
+    if manifest_text:
+        try:
+            homepage_url = json.loads(manifest_text).get("homepage_url") or ""
+        except (ValueError, AttributeError):
+            homepage_url = ""
+        if CHROME_LINK_RE.fullmatch(homepage_url):
+            links = list(dict.fromkeys(links + [homepage_url]))
+    return links
+
+# Batch size to use for a requested size
+def plan_batch_size(requested: int) -> int:
+    return min(max(1, requested), MAX_BATCH_SIZE)
+
+# Build one query with an aliased repository sub-query per repo, selecting
+# fields(repo) in each; repos are (owner, name, ...) tuples
+def build_aliased_query(repos: list, fields) -> Tuple[str, dict]:
+    params, selections, variables = [], [], {}
+    for i, repo in enumerate(repos):
+        params.append(f"$o{i}:String!,$n{i}:String!")
+        selections.append(f"r{i}: repository(owner:$o{i},name:$n{i}){{{fields(repo)}}}")
+        variables[f"o{i}"] = repo[0]
+        variables[f"n{i}"] = repo[1]
+    query = "query(%s){\n%s\n}" % (",".join(params), "\n".join(selections))
+    return query, variables
+
+# Build the phase one query for each repo's (owner, name)
+def build_batch_query(repos: List[Tuple[str, str]]) -> Tuple[str, dict]:
+    return build_aliased_query(repos, lambda repo: REPO_FIELDS)
+
+# Build the phase two query: blob text for each repo's (owner, name, paths)
+def build_blob_query(repos: List[Tuple[str, str, List[str]]]) -> Tuple[str, dict]:
+    def blob_fields(repo):
+        return " ".join(
+            f"b{j}: object(expression:{json.dumps('HEAD:' + path)}){{... on Blob {{ text }}}}"
+            for j, path in enumerate(repo[2])
+        )
+    return build_aliased_query(repos, blob_fields)
+
+# Build the revalidation query: only the HEAD oid of each (owner, name)
+def build_oid_query(repos: List[Tuple[str, str]]) -> Tuple[str, dict]:
+    return build_aliased_query(repos, lambda repo: OID_FIELDS)
+
+# Default branch HEAD oid from a repository sub-query result
+def head_oid(repo_data: Optional[dict]) -> Optional[str]:
+    target = ((repo_data or {}).get("defaultBranchRef") or {}).get("target") or {}
+    return target.get("oid")
+
+# Raised when a batched request fails as a whole
+class BatchError(Exception):
+    pass
+
+# Post one query; returns the response data. Rate limited responses are
+# retried once the token pool's pause until the reset time is over.
+async def post_graphql(session: aiohttp.ClientSession, query: str, variables: dict, label: str, pool: Optional[TokenPool] = None) -> dict:
+    pool = pool or token_pool
+    payload = {"query": query, "variables": variables}
+    while True:
+        token = await pool.wait_async("graphql")
+        headers = {**HEADERS, "Authorization": f"token {token}"}
+        host = host_of(GRAPHQL_URL)
+        started = time.perf_counter()
+        async with session.post(GRAPHQL_URL, json=payload, headers=headers) as resp:
+            body = await resp.read()
+            metrics.observe("http_request_seconds", time.perf_counter() - started, host=host)
+            metrics.inc("http_requests_total", host=host, status=resp.status)
+            metrics.inc("http_response_bytes_total", len(body), host=host)
+            pool.update("graphql", resp.headers, resp.status, token=token, body=body)
+            if is_rate_limited(resp.status, resp.headers, body):
+                print(f"\nRate limit reached for {label}, reset at {resp.headers.get('X-RateLimit-Reset')}")
+                continue
+            if resp.status != 200:
+                raise BatchError(f"HTTP {resp.status}")
+            data = await resp.json()
+        if any(err.get("type") == "RATE_LIMITED" for err in data.get("errors", [])):
+            pool.mark_exhausted("graphql", resp.headers, token=token)
+            print(f"\nRate limit reached for {label}, reset at {resp.headers.get('X-RateLimit-Reset')}")
+            continue
+        if not data.get("data"):
+            raise BatchError(str(data.get("errors")))
+        return data["data"]
+
+# Marks items whose request failed, as opposed to aliases that resolved to
+# null because the repository does not exist
+FAILED = object()
+
+# Post a batch query, splitting it in half on failure; returns the data of
+# each item's alias, or FAILED for items that failed on their own
+async def post_with_split(session: aiohttp.ClientSession, items: list, build_query, labels: List[str], pool: Optional[TokenPool] = None) -> List[Optional[dict]]:
+    query, variables = build_query(items)
+    try:
+        data = await post_graphql(session, query, variables, labels[0] if len(labels) == 1 else f"batch of {len(labels)} repos", pool)
+    except (BatchError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if len(items) == 1:
+            print(f"Failed {labels[0]}: {e}")
+            return [FAILED]
+        metrics.inc("http_retries_total", host=host_of(GRAPHQL_URL))
+        mid = len(items) // 2
+        left, right = await asyncio.gather(
+            post_with_split(session, items[:mid], build_query, labels[:mid], pool),
+            post_with_split(session, items[mid:], build_query, labels[mid:], pool),
+        )
+        return left + right
+    # aliases of missing repos resolve to null while the rest still succeed
+    return [data.get(f"r{i}") for i in range(len(items))]
+
+# Fetch a batch of repos: phase one lists root entries and checks for a
+# manifest, phase two downloads only the README blobs under the size cap.
+# Returns (repo_url, status, links, head_oid) for every repo.
+async def fetch_and_extract_batch(
+    session: aiohttp.ClientSession,
+    repo_urls: List[str],
+    max_readme_bytes: int = DEFAULT_MAX_README_BYTES,
+    manifest_homepage: bool = False,
+    pool: Optional[TokenPool] = None,
+) -> List[Tuple[str, str, Optional[List[str]], Optional[str]]]:
+    results, valid_urls, repos = [], [], []
+    for repo_url in repo_urls:
+        try:
+            repos.append(repo_from_url(repo_url))
+            valid_urls.append(repo_url)
+        except ValueError:
+            results.append((repo_url, ERROR, None, None))
+    if not repos:
+        metrics.inc("items_total", len(results), stage="extract")
+        return results
+
+    trees = await post_with_split(session, repos, build_batch_query, valid_urls, pool)
+
+    blob_repos, blob_urls, blob_oids = [], [], []
+    for repo_url, (owner, name), repo_data in zip(valid_urls, repos, trees):
+        if repo_data is FAILED:
+            results.append((repo_url, ERROR, None, None))
+            continue
+        oid = head_oid(repo_data)
         # skip repos without manifest
-        if not repo_data.get("manifest"):
-            return repo_url, None
-        # scan all README-like entries for links
-        for entry in repo_data.get("root", {}).get("entries", []):
-            name_lower = entry.get("name", "").lower()
-            if name_lower.startswith("readme"):
-                blob = entry.get("object") or {}
-                text = blob.get("text", "") or ""
-                links = extract_links_from_text(text)
-                if links:
-                    return repo_url, links
-        # manifest exists but no links found
-        return repo_url, []
+        if not repo_data or not repo_data.get("manifest"):
+            results.append((repo_url, NO_MANIFEST, None, oid))
+            continue
+        paths = readme_paths(repo_data, max_readme_bytes)
+        if manifest_homepage:
+            paths.append("manifest.json")
+        if not paths:
+            # manifest exists but no README to scan
+            results.append((repo_url, NO_LINK, [], oid))
+            continue
+        blob_repos.append((owner, name, paths))
+        blob_urls.append(repo_url)
+        blob_oids.append(oid)
 
-# Main function
-async def main():
-    import argparse
-    parser = argparse.ArgumentParser(
-        description="Scrape Chrome extension links with slicing and indexed outputs"
-    )
-    parser.add_argument(
-        "--start", type=int, default=0,
-        help="Start index (0-based) of repos list"
-    )
-    parser.add_argument(
-        "--end", type=int, default=None,
-        help="End index (exclusive) of repos list"
+    if blob_repos:
+        blobs = await post_with_split(session, blob_repos, build_blob_query, blob_urls, pool)
+        for repo_url, (_, _, paths), oid, blob_data in zip(blob_urls, blob_repos, blob_oids, blobs):
+            # a failed request, or a repo that vanished between the phases,
+            # is an error rather than a repo without links
+            if blob_data is FAILED or blob_data is None:
+                results.append((repo_url, ERROR, None, None))
+                continue
+            texts = [(blob_data.get(f"b{j}") or {}).get("text") for j in range(len(paths))]
+            manifest_text = texts.pop() if manifest_homepage else None
+            links = links_from_blobs(texts, manifest_text)
+            results.append((repo_url, DONE if links else NO_LINK, links, oid))
+    metrics.inc("items_total", len(results), stage="extract")
+    return results
+
+# Fetch only the HEAD oid of each repo; returns (repo_url, oid) pairs, where
+# oid is None for missing repos and FAILED for repos whose request failed
+async def fetch_head_oids(session: aiohttp.ClientSession, repo_urls: List[str]) -> list:
+    results, valid_urls, repos = [], [], []
+    for repo_url in repo_urls:
+        try:
+            repos.append(repo_from_url(repo_url))
+            valid_urls.append(repo_url)
+        except ValueError:
+            results.append((repo_url, None))
+    if repos:
+        for repo_url, repo_data in zip(valid_urls, await post_with_split(session, repos, build_oid_query, valid_urls)):
+            results.append((repo_url, FAILED if repo_data is FAILED else head_oid(repo_data)))
+    return results
+
+# Re-queue journaled repos whose HEAD moved since they were extracted, so
+# unchanged repos keep their recorded links without downloading any blobs.
+# Repos that are missing or have no commits have no HEAD to compare and
+# would come back the same every run, so they are only re-queued with
+# retry_missing.
+async def revalidate(session: aiohttp.ClientSession, journal: JobJournal, concurrency: int, retry_missing: bool = False) -> None:
+    recorded = journal.recorded_oids()
+    total = len(recorded)
+    print(f"Checking {total} journaled repos for new commits...")
+    urls = list(recorded)
+    batches = (urls[i:i + MAX_BATCH_SIZE] for i in range(0, total, MAX_BATCH_SIZE))
+    checked = changed = missing = 0
+
+    def on_results(results):
+        nonlocal checked, changed, missing
+        checked += len(results)
+        moved = list()
+        for repo_url, oid in results:
+            if oid is None:
+                missing += 1
+                if retry_missing:
+                    moved.append(repo_url)
+            elif oid is not FAILED and oid != recorded[repo_url]:
+                moved.append(repo_url)
+        changed += len(moved)
+        journal.requeue(moved)
+        print_progress(checked, total)
+
+    await run_workers(
+        batches, lambda batch: fetch_head_oids(session, batch), on_results, concurrency,
+        on_failure=lambda batch: [(repo_url, FAILED) for repo_url in batch],
     )
-    args = parser.parse_args()
+    print(f"\n{changed} of {total} repos changed since they were extracted")
+    if missing and not retry_missing:
+        print(f"{missing} repos are missing or empty; pass --retry_errors to extract them again")
 
-    # Load URLs and slice
-    with open(LINKS_PATH) as f:
-        repo_urls = json.load(f)
-    total_repos = len(repo_urls)
-    start = args.start
-    end = args.end if args.end is not None else total_repos
-    if start < 0 or start >= total_repos or end < start:
-        print(f"Invalid range: start={start}, end={end}, total={total_repos}")
-        return
-    subset = repo_urls[start:end]
-    total = len(subset)
+# Fetch manifest and README via GraphQL and extract links
+async def fetch_and_extract(
+    session: aiohttp.ClientSession,
+    repo_url: str,
+    max_readme_bytes: int = DEFAULT_MAX_README_BYTES,
+    manifest_homepage: bool = False,
+) -> Tuple[str, str, Optional[List[str]], Optional[str]]:
+    results = await fetch_and_extract_batch(session, [repo_url], max_readme_bytes, manifest_homepage)
+    return results[0]
 
-    results_with = {}
-    results_noext = []
-    timeout = aiohttp.ClientTimeout(total=120)
-    connector = aiohttp.TCPConnector(limit=20)
+# Feed batches through a bounded queue to a fixed pool of workers, so the
+# number of coroutines and pending responses stays at `num_workers` no
+# matter how many repos there are. The workers run in a task group, so if
+# one dies the producer is cancelled instead of blocking on a full queue.
+async def run_workers(batches, process, on_results, num_workers: int, on_failure=None) -> None:
+    # results recorded for a batch whose processing raised
+    on_failure = on_failure or (lambda batch: [(repo_url, ERROR, None, None) for repo_url in batch])
+    queue = asyncio.Queue(maxsize=num_workers * 2)
 
-    async with aiohttp.ClientSession(headers=HEADERS, timeout=timeout, connector=connector) as session:
-        tasks = [asyncio.create_task(fetch_and_extract(session, url)) for url in subset]
-        for idx, fut in enumerate(asyncio.as_completed(tasks), start=1):
-            repo_url, links = await fut
-            if links is None:
-                continue
-            if links:
-                results_with[repo_url] = links
-            else:
-                results_noext.append(repo_url)
-            print_progress(idx, total)
+    async def worker():
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            try:
+                results = await process(batch)
+            except Exception as e:
+                print(f"\nFailed batch starting at {batch[0]}: {e}")
+                results = on_failure(batch)
+            on_results(results)
+
+    async with asyncio.TaskGroup() as group:
+        for _ in range(num_workers):
+            group.create_task(worker())
+        for batch in batches:
+            await queue.put(batch)
+        for _ in range(num_workers):
+            await queue.put(None)
 
+# Write the results of a --start/--end slice as indexed fragment files
+def write_fragments(results_with: dict, results_noext: List[str], suffix: str, total: int) -> None:
     out_dir = os.path.join(BASE_DIR, "extracted_urls")
     os.makedirs(out_dir, exist_ok=True)
 
     # Generate indexed output file names
-    suffix = f"_{start}_{end}"
     out_with = os.path.join(out_dir, f"chrome_links{suffix}.json")
     out_noext = os.path.join(out_dir, f"chrome_links_noext{suffix}.json")
 
@@ -161,5 +365,132 @@ async def main():
         json.dump(results_noext, f, indent=2)
     print(f"Saved extension link JSON to {out_with} and no-link list to {out_noext}")
 
+# Main function
+async def main():
+    global token_pool
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Scrape Chrome extension links into a resumable journal, or into indexed slices"
+    )
+    parser.add_argument(
+        "--start", type=int, default=None,
+        help="Start index (0-based) of repos list; slices bypass the journal"
+    )
+    parser.add_argument(
+        "--end", type=int, default=None,
+        help="End index (exclusive) of repos list; slices bypass the journal"
+    )
+    parser.add_argument(
+        "--links_path", type=str, default=LINKS_PATH,
+        help="JSON list of repo URLs to process (default: extracted_urls/github_links.json)"
+    )
+    parser.add_argument(
+        "--journal_path", type=str, default=JOURNAL_PATH,
+        help="SQLite journal recording each repo's status (default: extracted_urls/chrome_links.sqlite3)"
+    )
+    parser.add_argument(
+        "--retry_errors", action="store_true",
+        help="Also retry repos whose extraction failed in an earlier run (with --revalidate, also missing or empty repos)"
+    )
+    parser.add_argument(
+        "--revalidate", action="store_true",
+        help="Re-extract journaled repos whose default branch HEAD moved since the last run"
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=None,
+        help="Number of repos to query per GraphQL request (default: one request per repo)"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=20,
+        help="Number of requests (or batches) in flight"
+    )
+    parser.add_argument(
+        "--max_readme_bytes", type=int, default=DEFAULT_MAX_README_BYTES,
+        help="Skip README blobs larger than this many bytes"
+    )
+    parser.add_argument(
+        "--manifest_homepage", action="store_true",
+        help="Also take Chrome Web Store links from the manifest.json homepage_url"
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_run(args.metrics_path, args.metrics_interval)
+
+    token_pool = TokenPool(load_github_tokens(SECRET_PATH))
+
+    repo_urls = read_json_file(args.links_path)
+    is_default_links = os.path.abspath(args.links_path) == LINKS_PATH
+
+    journal = None
+    if args.start is None and args.end is None:
+        # Journal mode: record every result as it completes and resume with
+        # the repos still pending. An explicit --links_path is re-processed.
+        journal = JobJournal(args.journal_path)
+        journal.add(repo_urls, reset=not is_default_links)
+    else:
+        # Load URLs and slice
+        total_repos = len(repo_urls)
+        start = args.start or 0
+        end = args.end if args.end is not None else total_repos
+        if start < 0 or start >= total_repos or end < start:
+            print(f"Invalid range: start={start}, end={end}, total={total_repos}")
+            return
+        subset = repo_urls[start:end]
+
+    results_with = {}
+    results_noext = []
+    done = 0
+
+    def on_results(results):
+        nonlocal done
+        done += len(results)
+        if journal:
+            journal.record(results)
+        else:
+            for repo_url, status, links, _ in results:
+                if status == DONE:
+                    results_with[repo_url] = links
+                elif status == NO_LINK:
+                    results_noext.append(repo_url)
+        print_progress(done, total)
+
+    batch_size = 1
+    if args.batch_size:
+        batch_size = plan_batch_size(args.batch_size)
+        if batch_size < args.batch_size:
+            print(f"Batch size capped at {batch_size} by GraphQL query limits")
+
+    timeout = aiohttp.ClientTimeout(total=120)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+
+    async with aiohttp.ClientSession(headers=HEADERS, timeout=timeout, connector=connector) as session:
+        if journal:
+            if args.revalidate:
+                await revalidate(session, journal, args.concurrency, args.retry_errors)
+            subset = journal.pending(retry_errors=args.retry_errors)
+            print(f"{len(subset)} repos pending in {args.journal_path}")
+        total = len(subset)
+        batches = (subset[i:i + batch_size] for i in range(0, total, batch_size))
+
+        async def process(batch):
+            return await fetch_and_extract_batch(session, batch, args.max_readme_bytes, args.manifest_homepage)
+
+        await run_workers(batches, process, on_results, args.concurrency)
+
+    if journal:
+        out_dir = os.path.join(BASE_DIR, "extracted_urls")
+        counts = journal.counts()
+        print(f"\nJournal status counts: {counts}")
+        for filename, count in journal.materialize(out_dir).items():
+            print(f"Wrote {count} entries to {os.path.join(out_dir, filename)}")
+        return
+
+    suffix = f"_{start}_{end}"
+    if not is_default_links:
+        # keep fragments of other input lists apart from the main slices
+        stem = os.path.splitext(os.path.basename(args.links_path))[0]
+        suffix = f"_{stem.replace(' ', '_')}{suffix}"
+    write_fragments(results_with, results_noext, suffix, total)
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,17 +1,121 @@
-import json
 import os
-from utils import write_json_to_file
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from utils import write_json_to_file, read_json_file
+from storage import iter_archive_lines, loads
 
-def extract_urls(input_directory, output_filepath):
-    output_urls = []
-    for filename in os.listdir(input_directory):
-        filepath = os.path.join(input_directory, filename)
-        with open(filepath) as f:
-            json_data = json.load(f)
-            items = json_data.get("items")
-            repository_urls = [item.get("html_url") for item in items]
-            output_urls += repository_urls
+INDEX_FIELDS = ["id", "full_name", "size", "pushed_at", "stargazers"]
+# Pages handed to the parse workers ahead of the one being consumed
+PAGES_IN_FLIGHT = 64
 
-    write_json_to_file(output_filepath, output_urls)
-    print(f"Extraction succeeded!\nWrote to file: {output_filepath}")
 
+def page_order(filename):
+    # bucket_<bucket>_page_<page>.json in bucket, then page order
+    return [int(n) for n in re.findall(r"\d+", filename)], filename
+
+
+def read_page_items(filepath):
+    # Runs in a worker process and returns only the fields needed downstream
+    return os.path.basename(filepath), page_items(read_json_file(filepath))
+
+
+def read_archive_items(line):
+    # Same as read_page_items, for one line of a page archive
+    record = loads(line)
+    return record["name"], page_items(record["data"])
+
+
+def page_items(json_data):
+    return [
+        (
+            item.get("html_url"),
+            [
+                item.get("id"),
+                item.get("full_name"),
+                item.get("size"),
+                item.get("pushed_at"),
+                item.get("stargazers_count"),
+            ],
+        )
+        for item in json_data.get("items")
+    ]
+
+
+def parse_pages(executor, function, inputs):
+    # Like executor.map, but submits inputs only PAGES_IN_FLIGHT ahead of
+    # the result being consumed, so an archive is not read into memory
+    # before the first page is parsed
+    pending = deque()
+    for item in inputs:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= PAGES_IN_FLIGHT:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def index_filepath_for(output_filepath):
+    root, ext = os.path.splitext(output_filepath)
+    return f"{root}_index{ext}"
+
+
+def extract_urls(input_path, output_filepath, num_workers=None):
+    # Pages are parsed in parallel and repos are deduplicated by id (repos
+    # matching several queries or buckets appear on several pages), keeping
+    # the order in which they were first seen. input_path is a directory of
+    # page files or a single page archive. Pages are consumed as they are
+    # parsed, whatever their order: each repo keeps the position of its
+    # earliest occurrence in page order, and only the unique repos are
+    # sorted at the end.
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        if os.path.isdir(input_path):
+            filepaths = (
+                os.path.join(input_path, filename) for filename in os.listdir(input_path)
+            )
+            pages = parse_pages(executor, read_page_items, filepaths)
+        else:
+            pages = parse_pages(executor, read_archive_items, iter_archive_lines(input_path))
+
+        first_seen = dict()
+        total = 0
+        for name, items in pages:
+            order = page_order(name)
+            for position, (html_url, index_row) in enumerate(items):
+                total += 1
+                key = index_row[0] or html_url
+                if key not in first_seen or (order, position) < first_seen[key][0]:
+                    first_seen[key] = ((order, position), html_url, index_row)
+
+    repos = {
+        key: (html_url, index_row)
+        for key, (_, html_url, index_row) in sorted(
+            first_seen.items(), key=lambda entry: entry[1][0]
+        )
+    }
+    write_repo_urls(output_filepath, repos)
+    print(f"Extraction succeeded! {len(repos)} unique repos ({total - len(repos)} duplicates removed)")
+    print(f"Wrote to file: {output_filepath}\nWrote index to: {index_filepath_for(output_filepath)}")
+
+
+def write_repo_urls(output_filepath, repos):
+    # repos: id -> (html_url, index row), in output order
+    write_json_to_file(output_filepath, [html_url for html_url, _ in repos.values()])
+
+    # Compact side index, so later stages can prioritize or shard repos
+    # without re-reading the raw pages
+    write_json_to_file(
+        index_filepath_for(output_filepath),
+        {"fields": INDEX_FIELDS, "repos": [row for _, row in repos.values()]},
+        compact=True,
+    )
+
+
+def merge_urls(output_filepath, new_urls_filepath):
+    # Appends the urls not seen before, keeping the existing order
+    existing_urls = (
+        read_json_file(output_filepath) if os.path.isfile(output_filepath) else []
+    )
+    merged_urls = list(dict.fromkeys(existing_urls + read_json_file(new_urls_filepath)))
+    write_json_to_file(output_filepath, merged_urls)
+    return len(merged_urls) - len(existing_urls)
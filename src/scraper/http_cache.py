@@ -0,0 +1,144 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+def cache_key(url, params):
+    return json.dumps([url, sorted((params or {}).items())], default=str)
+
+
+# On-disk cache of successful GET responses, keyed on URL and params. Fresh
+# entries (younger than ttl seconds) are served without a request; stale
+# entries are revalidated with If-None-Match / If-Modified-Since, which GitHub
+# answers with a 304 that is not charged against the rate limit. Least
+# recently used entries are evicted once the bodies exceed max_bytes.
+class HttpCache:
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+            """
+        )
+
+    def get(self, url, params=None):
+        key = cache_key(url, params)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT url, status, headers, body, etag, last_modified, stored_at "
+                "FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self.conn.commit()
+        url, status, headers, body, etag, last_modified, stored_at = row
+        return {
+            "key": key,
+            "url": url,
+            "status": status,
+            "headers": json.loads(headers),
+            "body": body,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": stored_at,
+        }
+
+    def is_fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.ttl
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def revalidated(self, entry):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE entries SET stored_at = ? WHERE key = ?",
+                (time.time(), entry["key"]),
+            )
+            self.conn.commit()
+
+    def store(self, url, params, status, headers, body):
+        key = cache_key(url, params)
+        now = time.time()
+        headers = {
+            name: value
+            for name, value in headers.items()
+            if name.lower() in ("content-type", "etag", "last-modified")
+        }
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    url,
+                    status,
+                    json.dumps(headers),
+                    body,
+                    CaseInsensitiveDict(headers).get("ETag"),
+                    CaseInsensitiveDict(headers).get("Last-Modified"),
+                    now,
+                    now,
+                    len(body),
+                ),
+            )
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        # Summed from the table rather than kept in memory, since several
+        # processes may share the cache file
+        total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        while total_bytes > self.max_bytes:
+            row = self.conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+            total_bytes -= row[1]
+
+    def store_response(self, url, params, response):
+        self.store(url, params, response.status_code, response.headers, response.content)
+
+    def to_response(self, entry):
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["body"]
+        response.url = entry["url"]
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
@@ -0,0 +1,211 @@
+import os
+import json
+import sqlite3
+import time
+from metrics import metrics
+
+PENDING = "pending"
+DONE = "done"
+NO_MANIFEST = "no-manifest"
+NO_LINK = "no-link"
+ERROR = "error"
+
+
+def write_json_stream(filepath, rows, as_dict):
+    # Writes rows as a JSON object (url -> links) or list (url) one entry at a
+    # time, laid out like json.dump(..., indent=2), then swaps the file in
+    tmp_filepath = filepath + ".tmp"
+    count = 0
+    with metrics.timer("storage_write_seconds"), open(tmp_filepath, "w") as f:
+        f.write("{" if as_dict else "[")
+        for row in rows:
+            f.write(",\n  " if count else "\n  ")
+            if as_dict:
+                url, links = row
+                links_json = json.dumps(json.loads(links), indent=2)
+                f.write(f"{json.dumps(url)}: {links_json.replace(chr(10), chr(10) + '  ')}")
+            else:
+                f.write(json.dumps(row[0]))
+            count += 1
+        f.write("\n" if count else "")
+        f.write("}" if as_dict else "]")
+        metrics.inc("storage_write_bytes_total", f.tell())
+    os.replace(tmp_filepath, filepath)
+    return count
+
+
+# SQLite record of every repo's extraction status. Results are recorded as
+# they complete, so an interrupted run resumes with the repos still pending,
+# and the combined outputs are written straight from indexed queries.
+class JobJournal:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS repos (
+                url TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                links TEXT,
+                head_oid TEXT,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS repos_status_seq ON repos (status, seq);
+            CREATE TABLE IF NOT EXISTS extensions (
+                id TEXT PRIMARY KEY,
+                metadata TEXT,
+                error TEXT,
+                updated_at REAL
+            );
+            """
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(repos)")]
+        if "head_oid" not in columns:
+            # journals created before HEAD oids were recorded
+            self.conn.execute("ALTER TABLE repos ADD COLUMN head_oid TEXT")
+        # read once; add() hands out sequence numbers from here on
+        self.next_seq = self.conn.execute(
+            "SELECT COALESCE(MAX(seq), -1) + 1 FROM repos"
+        ).fetchone()[0]
+
+    # Adds repos as pending, keeping the status of those already journaled
+    # unless `reset` is set
+    def add(self, urls, reset=False):
+        urls = list(urls)
+        next_seq = self.next_seq
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO repos (url, seq, status) VALUES (?, ?, ?)",
+                ((url, next_seq + i, PENDING) for i, url in enumerate(urls)),
+            )
+            if reset:
+                self.conn.executemany(
+                    "UPDATE repos SET status = ? WHERE url = ?",
+                    ((PENDING, url) for url in urls),
+                )
+        self.next_seq = next_seq + len(urls)
+
+    def pending(self, retry_errors=False):
+        statuses = [PENDING, ERROR] if retry_errors else [PENDING]
+        placeholders = ", ".join("?" * len(statuses))
+        return [
+            url
+            for (url,) in self.conn.execute(
+                f"SELECT url FROM repos WHERE status IN ({placeholders}) ORDER BY seq",
+                statuses,
+            )
+        ]
+
+    def record(self, results):
+        # results: (url, status, links, head_oid) tuples
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE repos SET status = ?, links = ?, head_oid = ?, updated_at = ? "
+                "WHERE url = ?",
+                (
+                    (status, json.dumps(links) if links else None, head_oid, now, url)
+                    for url, status, links, head_oid in results
+                ),
+            )
+
+    # url -> HEAD oid (None if never recorded) of every repo with a result
+    def recorded_oids(self):
+        return dict(
+            self.conn.execute(
+                "SELECT url, head_oid FROM repos WHERE status IN (?, ?, ?) ORDER BY seq",
+                (DONE, NO_MANIFEST, NO_LINK),
+            )
+        )
+
+    # url -> (status, links) of the given repos that are journaled
+    def lookup(self, urls):
+        found = dict()
+        urls = list(urls)
+        for i in range(0, len(urls), 500):
+            chunk = urls[i : i + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            for url, status, links in self.conn.execute(
+                f"SELECT url, status, links FROM repos WHERE url IN ({placeholders})",
+                chunk,
+            ):
+                found[url] = (status, json.loads(links) if links else None)
+        return found
+
+    def requeue(self, urls):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE repos SET status = ? WHERE url = ?",
+                ((PENDING, url) for url in urls),
+            )
+
+    # Web Store results are recorded per extension ID, so the pipeline can
+    # fan them out to every repo linking to an extension without holding
+    # them in memory
+    def record_extension(self, ext_id, metadata, error):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extensions (id, metadata, error, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (ext_id, json.dumps(metadata) if metadata else None, error, time.time()),
+            )
+
+    # extension ID -> (metadata, error) of the given extensions
+    def extension_results(self, ext_ids):
+        ext_ids = list(ext_ids)
+        placeholders = ", ".join("?" * len(ext_ids))
+        return {
+            ext_id: (json.loads(metadata) if metadata else None, error)
+            for ext_id, metadata, error in self.conn.execute(
+                f"SELECT id, metadata, error FROM extensions WHERE id IN ({placeholders})",
+                ext_ids,
+            )
+        }
+
+    # Writes the metadata of the extensions scraped without error since
+    # `since` as a JSON object keyed by extension ID
+    def write_extensions(self, filepath, since=0):
+        return write_json_stream(
+            filepath,
+            self.conn.execute(
+                "SELECT id, metadata FROM extensions "
+                "WHERE error IS NULL AND updated_at >= ? ORDER BY id",
+                (since,),
+            ),
+            as_dict=True,
+        )
+
+    def counts(self):
+        return dict(
+            self.conn.execute("SELECT status, COUNT(*) FROM repos GROUP BY status")
+        )
+
+    def materialize(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        written = dict()
+        written["chrome_links.json"] = write_json_stream(
+            os.path.join(out_dir, "chrome_links.json"),
+            self.conn.execute(
+                "SELECT url, links FROM repos WHERE status = ? ORDER BY seq", (DONE,)
+            ),
+            as_dict=True,
+        )
+        written["chrome_links_noext.json"] = write_json_stream(
+            os.path.join(out_dir, "chrome_links_noext.json"),
+            self.conn.execute(
+                "SELECT url FROM repos WHERE status = ? ORDER BY seq", (NO_LINK,)
+            ),
+            as_dict=False,
+        )
+        written["chrome_links_remaining.json"] = write_json_stream(
+            os.path.join(out_dir, "chrome_links_remaining.json"),
+            self.conn.execute(
+                "SELECT url FROM repos WHERE status NOT IN (?, ?) ORDER BY seq",
+                (DONE, NO_LINK),
+            ),
+            as_dict=False,
+        )
+        return written
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Seconds between writes of the metrics file
+DEFAULT_FLUSH_INTERVAL = 10
+
+# Help text of every metric, in the order the summary lists them
+DESCRIPTIONS = {
+    "http_requests_total": "HTTP responses by host and status",
+    "http_request_seconds": "HTTP request latency by host",
+    "http_response_bytes_total": "Response body bytes downloaded by host",
+    "http_cache_hits_total": "Responses served from the on-disk cache by host",
+    "http_retries_total": "Failed attempts that were retried by host",
+    "http_backoff_seconds_total": "Seconds slept backing off before retries by host",
+    "rate_limit_wait_seconds_total": "Seconds paused by rate limit pacing by resource",
+    "parse_seconds": "Page parse time by parser",
+    "storage_write_seconds": "JSON file write time",
+    "storage_write_bytes_total": "Bytes of JSON written before compression",
+    "items_total": "Items processed by stage",
+}
+
+
+def host_of(url):
+    return urlparse(url).hostname or "unknown"
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key):
+    return ",".join(f'{name}="{value}"' for name, value in key)
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # counts[i] is the number of values <= bounds[i]; the last is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th value
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip([str(b) for b in self.bounds] + ["+Inf"], self.counts)),
+        }
+
+
+# Counters and latency histograms shared by every stage of a run. All
+# methods are thread-safe; values live in this process only, so work done in
+# a process pool is measured by the caller.
+class Metrics:
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started_at = clock()
+        # name -> label key -> value
+        self.counters = dict()
+        self.histograms = dict()
+        self.flusher = None
+
+    def inc(self, name, value=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, dict())
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "elapsed_seconds": self.clock() - self.started_at,
+                "counters": {
+                    name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                    for name, series in self.counters.items()
+                },
+                "histograms": {
+                    name: [
+                        {"labels": dict(key), **histogram.to_dict()}
+                        for key, histogram in series.items()
+                    ]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def to_prometheus(self):
+        lines = list()
+        with self.lock:
+            for name, series in self.counters.items():
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{{{format_labels(key)}}} {value}")
+            for name, series in self.histograms.items():
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(
+                        [str(b) for b in histogram.bounds] + ["+Inf"], histogram.counts
+                    ):
+                        cumulative += count
+                        labels = format_labels(key + (("le", bound),))
+                        lines.append(f"{name}_bucket{{{labels}}} {cumulative}")
+                    lines.append(f"{name}_sum{{{format_labels(key)}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{format_labels(key)}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, filepath):
+        # Prometheus text format for .prom files, json otherwise. Written to
+        # a temporary file first so readers never see a partial file.
+        if filepath.endswith(".prom"):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.snapshot(), indent=4)
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        tmp_filepath = filepath + ".tmp"
+        with open(tmp_filepath, "w") as f:
+            f.write(text)
+        os.replace(tmp_filepath, filepath)
+
+    def start_flushing(self, filepath, interval=DEFAULT_FLUSH_INTERVAL):
+        self.flusher = MetricsFlusher(self, filepath, interval)
+        self.flusher.start()
+
+    def close(self):
+        # Stops the periodic flush and writes the final values
+        if self.flusher:
+            self.flusher.stop()
+            self.flusher = None
+
+    def add_arguments(self, parser):
+        # The --metrics_path and --metrics_interval flags every script
+        # passes on to start_run
+        parser.add_argument(
+            "--metrics_path",
+            type=str,
+            help="Write metrics to this file every --metrics_interval seconds (.prom for Prometheus text format, json otherwise)",
+        )
+        parser.add_argument(
+            "--metrics_interval",
+            type=int,
+            default=DEFAULT_FLUSH_INTERVAL,
+            help="Seconds between metrics file writes",
+        )
+
+    def start_run(self, filepath=None, interval=DEFAULT_FLUSH_INTERVAL):
+        # Called by each script's main: flushes to `filepath` if given, and
+        # writes it a last time and prints the summary when the run exits,
+        # however it exits
+        self.started_at = self.clock()
+        if filepath:
+            self.start_flushing(filepath, interval)
+
+        def finish():
+            self.close()
+            print(f"\n{self.summary()}")
+
+        atexit.register(finish)
+
+    def summary(self):
+        elapsed = self.clock() - self.started_at
+        lines = [f"Metrics after {elapsed:.1f}s:"]
+        with self.lock:
+            for name in DESCRIPTIONS:
+                for key, value in sorted(self.counters.get(name, dict()).items()):
+                    labels = f"{{{format_labels(key)}}}" if key else ""
+                    rate = ""
+                    if name == "items_total" and elapsed > 0:
+                        rate = f" ({value / elapsed:.1f}/s)"
+                    amount = f"{value:.1f}" if isinstance(value, float) else value
+                    lines.append(f"  {name}{labels} {amount}{rate}")
+                for key, histogram in sorted(self.histograms.get(name, dict()).items()):
+                    labels = f"{{{format_labels(key)}}}" if key else ""
+                    mean = histogram.sum / histogram.count if histogram.count else 0.0
+                    lines.append(
+                        f"  {name}{labels} count {histogram.count}, mean {mean:.3f}s, "
+                        f"p50 <= {histogram.quantile(0.5)}s, p99 <= {histogram.quantile(0.99)}s"
+                    )
+        return "\n".join(lines)
+
+
+# Writes the metrics to a file every `interval` seconds from a daemon thread,
+# and once more when stopped
+class MetricsFlusher(threading.Thread):
+    def __init__(self, metrics, filepath, interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.filepath = filepath
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.write(self.filepath)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.metrics.write(self.filepath)
+
+
+# Shared by every module of the scraper
+metrics = Metrics()
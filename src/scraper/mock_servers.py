@@ -0,0 +1,294 @@
+import os
+import re
+import time
+import zlib
+import random
+import socket
+import asyncio
+import argparse
+import multiprocessing
+from aiohttp import web
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BASE_DIR, "fixtures")
+# GitHub search only returns the first 1000 results of a query
+SEARCH_RESULT_CAP = 1000
+# Extension IDs use the letters a-p for the 16 hex digits
+ID_ALPHABET = str.maketrans("0123456789abcdef", "abcdefghijklmnop")
+VARIABLE_RE = re.compile(r"^n(\d+)$")
+
+
+def mock_extension_id(n):
+    return format(n, "032x").translate(ID_ALPHABET)
+
+
+def mock_repo_number(name):
+    # repos are named repo<n>; anything else is treated as missing
+    match = re.fullmatch(r"repo(\d+)", name)
+    return int(match.group(1)) if match else None
+
+
+# Injects the configured latency (with up to `jitter` seconds on top) and
+# the share of requests answered with a server error
+class Faults:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=502, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+
+    async def delay(self):
+        seconds = self.latency + self.rng.uniform(0, self.jitter)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def error(self):
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return web.Response(status=self.error_status, text="Injected error")
+        return None
+
+
+# Request budget per resource, reported in GitHub's X-RateLimit-* headers.
+# Once a window's budget is spent, requests get a 403 with
+# X-RateLimit-Remaining: 0 until the window resets.
+class RateLimitWindow:
+    def __init__(self, resource, limit, window):
+        self.resource = resource
+        self.limit = limit
+        self.window = window
+        self.reset = 0
+        self.used = 0
+
+    def spend(self):
+        now = time.time()
+        if now >= self.reset:
+            self.reset = int(now) + self.window
+            self.used = 0
+        allowed = self.used < self.limit
+        if allowed:
+            self.used += 1
+        return allowed, {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.limit - self.used),
+            "X-RateLimit-Used": str(self.used),
+            "X-RateLimit-Reset": str(self.reset),
+            "X-RateLimit-Resource": self.resource,
+        }
+
+
+# Stand-in for the GitHub search REST endpoint and the GraphQL endpoint
+# extract_chromex queries. Every search query matches the same `num_repos`
+# repos. One repo in `manifest_every` has a manifest.json, and one in
+# `link_every` of those links to a Web Store extension from its README.
+class MockGitHub:
+    def __init__(
+        self,
+        num_repos=1000,
+        rate_limit=100_000,
+        rate_window=60,
+        manifest_every=2,
+        link_every=2,
+        num_extensions=500,
+        faults=None,
+    ):
+        self.num_repos = num_repos
+        self.manifest_every = manifest_every
+        self.link_every = link_every
+        self.num_extensions = num_extensions
+        self.faults = faults or Faults()
+        self.windows = {
+            resource: RateLimitWindow(resource, rate_limit, rate_window)
+            for resource in ("search", "graphql")
+        }
+
+    def repo(self, n):
+        return {
+            "id": n,
+            "html_url": f"https://github.com/owner{n}/repo{n}",
+            "full_name": f"owner{n}/repo{n}",
+            "size": n,
+            "pushed_at": "2024-01-01T00:00:00Z",
+            "stargazers_count": n % 100,
+        }
+
+    def has_manifest(self, n):
+        return n % self.manifest_every == 0
+
+    def readme(self, n):
+        if (n // self.manifest_every) % self.link_every:
+            return "An extension without a store listing"
+        ext_id = mock_extension_id(n % self.num_extensions)
+        return f"Install from https://chromewebstore.google.com/detail/mock/{ext_id}"
+
+    async def guarded(self, resource, handler, request):
+        await self.faults.delay()
+        allowed, headers = self.windows[resource].spend()
+        if not allowed:
+            return web.json_response(
+                {"message": "API rate limit exceeded"}, status=403, headers=headers
+            )
+        error = self.faults.error()
+        if error is not None:
+            error.headers.update(headers)
+            return error
+        response = await handler(request)
+        response.headers.update(headers)
+        return response
+
+    async def search(self, request):
+        per_page = int(request.query.get("per_page", 30))
+        page = int(request.query.get("page", 1))
+        start = (page - 1) * per_page
+        if start >= SEARCH_RESULT_CAP:
+            return web.json_response(
+                {"message": "Only the first 1000 search results are available"},
+                status=422,
+            )
+        end = min(start + per_page, self.num_repos, SEARCH_RESULT_CAP)
+        items = [self.repo(n) for n in range(start, end)]
+        return web.json_response(
+            {"total_count": self.num_repos, "incomplete_results": False, "items": items}
+        )
+
+    async def graphql(self, request):
+        body = await request.json()
+        query, variables = body["query"], body["variables"]
+        # phase two queries select blob text instead of the root tree
+        blobs = "... on Blob { text }" in query
+        data = dict()
+        for name, value in variables.items():
+            match = VARIABLE_RE.match(name)
+            if not match:
+                continue
+            alias = f"r{match.group(1)}"
+            n = mock_repo_number(value)
+            if n is None or n >= self.num_repos:
+                data[alias] = None
+            elif blobs:
+                data[alias] = {"b0": {"text": self.readme(n)}}
+            else:
+                data[alias] = {
+                    "defaultBranchRef": {"target": {"oid": f"{n:040x}"}},
+                    "manifest": {"byteSize": 512} if self.has_manifest(n) else None,
+                    "root": {
+                        "entries": [
+                            {"name": "README.md", "object": {"byteSize": 1024}},
+                            {"name": "manifest.json", "object": {"byteSize": 512}},
+                        ]
+                    },
+                }
+        return web.json_response({"data": data})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get(
+            "/search/repositories",
+            lambda request: self.guarded("search", self.search, request),
+        )
+        app.router.add_post(
+            "/graphql", lambda request: self.guarded("graphql", self.graphql, request)
+        )
+        return app
+
+
+# Stand-in for the Chrome Web Store that answers every detail page with one
+# of the fixture pages, picked by extension ID
+class MockWebStore:
+    def __init__(self, fixtures_dir=FIXTURES_DIR, faults=None):
+        self.pages = list()
+        for filename in sorted(os.listdir(fixtures_dir)):
+            if filename.endswith(".html"):
+                with open(os.path.join(fixtures_dir, filename), "rb") as f:
+                    self.pages.append(f.read())
+        self.faults = faults or Faults(error_status=503)
+
+    async def detail(self, request):
+        await self.faults.delay()
+        error = self.faults.error()
+        if error is not None:
+            return error
+        page = self.pages[zlib.crc32(request.match_info["id"].encode()) % len(self.pages)]
+        return web.Response(body=page, content_type="text/html", charset="utf-8")
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/detail/{id}", self.detail)
+        app.router.add_get("/detail/{name}/{id}", self.detail)
+        return app
+
+
+async def serve(apps, on_ready=None):
+    # Serves each app on its own free local port until cancelled
+    runners, urls = list(), list()
+    for app in apps:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(runner, sock).start()
+        runners.append(runner)
+        urls.append(f"http://127.0.0.1:{sock.getsockname()[1]}")
+    if on_ready:
+        on_ready(urls)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def run_servers(github_options, webstore_options, ready):
+    github = MockGitHub(**github_options)
+    webstore = MockWebStore(**webstore_options)
+    asyncio.run(serve([github.app(), webstore.app()], ready.put))
+
+
+# Starts both servers in a separate process, so their CPU time and memory
+# are not counted against the client being measured. Returns the process
+# and the (GitHub, Web Store) base URLs.
+def start_mock_servers(github_options=None, webstore_options=None):
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=run_servers,
+        args=(github_options or dict(), webstore_options or dict(), ready),
+        daemon=True,
+    )
+    process.start()
+    github_url, webstore_url = ready.get(timeout=30)
+    return process, github_url, webstore_url
+
+
+def stop_mock_servers(process):
+    process.terminate()
+    process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve mock GitHub and Chrome Web Store endpoints locally"
+    )
+    parser.add_argument("--num_repos", type=int, default=1000)
+    parser.add_argument("--rate_limit", type=int, default=100_000)
+    parser.add_argument("--rate_window", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    faults = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    github = MockGitHub(
+        num_repos=args.num_repos,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        faults=Faults(**faults),
+    )
+    webstore = MockWebStore(faults=Faults(error_status=503, **faults))
+
+    def announce(urls):
+        print(f"GitHub: {urls[0]}\nChrome Web Store: {urls[1]}")
+
+    try:
+        asyncio.run(serve([github.app(), webstore.app()], announce))
+    except KeyboardInterrupt:
+        pass
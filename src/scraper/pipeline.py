@@ -0,0 +1,421 @@
+import os
+import sys
+import asyncio
+import aiohttp
+import time
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import extract_chromex
+from scrape_repos import (
+    SEARCH_URL,
+    QUERIES,
+    HEADERS,
+    calculate_buckets,
+    bucket_pages,
+    fetch_bucket_page,
+    get_token_pool,
+)
+from extract_repo_urls import page_items, write_repo_urls, merge_urls
+from extract_chromex import (
+    fetch_and_extract_batch,
+    plan_batch_size,
+    DEFAULT_MAX_README_BYTES,
+    JOURNAL_PATH,
+    LINKS_PATH,
+)
+from cws_page_fetcher import (
+    PARSER_BACKENDS,
+    ResultWriter,
+    build_scrape_result,
+    clean_cws_url,
+    extension_id,
+    scrape_extension_async,
+    to_failed_urls_dict,
+)
+from journal import JobJournal, PENDING, DONE, ERROR
+from http_cache import HttpCache, DEFAULT_TTL
+from storage import open_page_store, available_compressions
+from metrics import metrics
+from utils import (
+    HttpClient,
+    read_json_file,
+    write_json_to_file,
+    get_latest_file,
+    directory_contains_files,
+    logger,
+)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Seconds a partial GraphQL batch waits for more repos before it is sent
+BATCH_LINGER = 2
+
+
+# Runs every stage at once: search result pages feed repo URLs to the
+# GraphQL extraction, whose Chrome Web Store links feed the Web Store
+# fetcher. Stages are joined by bounded queues, so a slow stage holds back
+# the one before it instead of letting work pile up in memory. The search
+# and Web Store requests share http_cache, and token_pool paces both the
+# search and the GraphQL requests.
+class Pipeline:
+    def __init__(
+        self, args, page_store, journal, writer, http_client, token_pool, http_cache=None
+    ):
+        self.args = args
+        self.page_store = page_store
+        self.journal = journal
+        self.writer = writer
+        self.http_client = http_client
+        self.token_pool = token_pool
+        self.http_cache = http_cache
+        self.batch_size = plan_batch_size(args.batch_size)
+        self.repo_queue = asyncio.Queue(maxsize=self.batch_size * args.concurrency * 2)
+        self.batch_queue = asyncio.Queue(maxsize=args.concurrency * 2)
+        self.link_queue = asyncio.Queue(maxsize=args.cws_workers * 2)
+        self.cws_semaphore = asyncio.Semaphore(args.cws_workers)
+        # repo id -> (html_url, index row) of every repo found, in order
+        self.repos = dict()
+        # extension ID -> task scraping it while it runs; finished results
+        # are recorded in the journal and only their IDs are kept
+        self.extension_tasks = dict()
+        self.extensions_seen = set()
+        self.extensions_started = 0
+        self.extensions_done = 0
+        self.pages_total = 0
+        self.pages_done = 0
+        self.pages_failed = 0
+        self.extracted = 0
+        self.with_links = 0
+
+    def fetch_and_store_page(self, bucket_index, query, page):
+        # Runs in a search thread
+        repo_json = fetch_bucket_page(
+            SEARCH_URL,
+            query,
+            page,
+            cache=self.http_cache,
+            client=self.http_client,
+            pool=self.token_pool,
+        )
+        self.page_store.write(f"bucket_{bucket_index}_page_{page}", repo_json)
+        return page_items(repo_json)
+
+    async def search(self, buckets, search_executor):
+        loop = asyncio.get_running_loop()
+        pages = bucket_pages(buckets)
+        self.pages_total = len(pages)
+        pending = iter(pages)
+
+        async def worker():
+            for bucket_index, query, page in pending:
+                try:
+                    items = await loop.run_in_executor(
+                        search_executor, self.fetch_and_store_page, bucket_index, query, page
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to fetch page {page} of bucket {bucket_index}: {e}")
+                    self.pages_failed += 1
+                    continue
+                self.pages_done += 1
+                # repos matching several queries or buckets are passed on once
+                for html_url, index_row in items:
+                    key = index_row[0] or html_url
+                    if key not in self.repos:
+                        self.repos[key] = (html_url, index_row)
+                        await self.repo_queue.put(html_url)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.args.search_workers)))
+        finally:
+            await self.repo_queue.put(None)
+
+    async def dispatch(self, batch):
+        # Repos journaled by an earlier run are not extracted again; the links
+        # of those that have them go straight to the Web Store stage
+        self.journal.add(batch)
+        statuses = [PENDING, ERROR] if self.args.retry_errors else [PENDING]
+        to_extract = list()
+        for repo_url, (status, links) in self.journal.lookup(batch).items():
+            if status in statuses:
+                to_extract.append(repo_url)
+            elif status == DONE:
+                self.with_links += 1
+                await self.link_queue.put((repo_url, links))
+        self.extracted += len(batch) - len(to_extract)
+        if to_extract:
+            await self.batch_queue.put(to_extract)
+
+    async def batch_repos(self):
+        batch = list()
+        try:
+            while True:
+                try:
+                    if batch:
+                        repo_url = await asyncio.wait_for(self.repo_queue.get(), BATCH_LINGER)
+                    else:
+                        repo_url = await self.repo_queue.get()
+                except asyncio.TimeoutError:
+                    await self.dispatch(batch)
+                    batch = list()
+                    continue
+                if repo_url is None:
+                    break
+                batch.append(repo_url)
+                if len(batch) >= self.batch_size:
+                    await self.dispatch(batch)
+                    batch = list()
+            if batch:
+                await self.dispatch(batch)
+        finally:
+            for _ in range(self.args.concurrency):
+                await self.batch_queue.put(None)
+
+    async def extract(self, session):
+        while True:
+            batch = await self.batch_queue.get()
+            if batch is None:
+                return
+            try:
+                results = await fetch_and_extract_batch(
+                    session,
+                    batch,
+                    self.args.max_readme_bytes,
+                    self.args.manifest_homepage,
+                    self.token_pool,
+                )
+            except Exception as e:
+                print(f"\nFailed batch starting at {batch[0]}: {e}")
+                results = [(repo_url, ERROR, None, None) for repo_url in batch]
+            self.journal.record(results)
+            self.extracted += len(results)
+            for repo_url, status, links, _ in results:
+                if status == DONE:
+                    self.with_links += 1
+                    await self.link_queue.put((repo_url, links))
+
+    async def scrape_extension(self, session, parse_executor, ext_id):
+        async with self.cws_semaphore:
+            _, metadata, error = await scrape_extension_async(
+                session, parse_executor, ext_id, self.args.parser, cache=self.http_cache
+            )
+        self.journal.record_extension(ext_id, metadata, error)
+        self.extensions_seen.add(ext_id)
+        del self.extension_tasks[ext_id]
+        self.extensions_done += 1
+
+    async def fetch_extensions(self, session, parse_executor):
+        # Each extension is scraped once, however many repos link to it
+        while True:
+            item = await self.link_queue.get()
+            if item is None:
+                return
+            repo_url, cws_urls = item
+            links = dict()
+            failed_urls = list()
+            for url in cws_urls:
+                cleaned_url = clean_cws_url(url)
+                if cleaned_url is None:
+                    failed_urls.append(to_failed_urls_dict(repo_url, url, "Cleaning failed"))
+                else:
+                    links.setdefault(extension_id(cleaned_url), cleaned_url)
+            for ext_id in links:
+                if ext_id not in self.extension_tasks and ext_id not in self.extensions_seen:
+                    self.extensions_started += 1
+                    self.extension_tasks[ext_id] = asyncio.create_task(
+                        self.scrape_extension(session, parse_executor, ext_id)
+                    )
+            await asyncio.gather(
+                *(self.extension_tasks[ext_id] for ext_id in links if ext_id in self.extension_tasks)
+            )
+            scrape_result, scrape_failed = build_scrape_result(
+                repo_url, links, self.journal.extension_results(links)
+            )
+            self.writer.write(scrape_result, failed_urls + scrape_failed)
+
+    def print_status(self):
+        sys.stdout.write(
+            f"\rPages {self.pages_done}/{self.pages_total} | "
+            f"repos {len(self.repos)} | extracted {self.extracted} | "
+            f"with links {self.with_links} | "
+            f"extensions {self.extensions_done}/{self.extensions_started} | "
+            f"scraped {self.writer.scraped_count}   "
+        )
+        sys.stdout.flush()
+
+    async def report(self):
+        while True:
+            self.print_status()
+            await asyncio.sleep(self.args.report_interval)
+
+    async def run(self, buckets):
+        graphql_session = aiohttp.ClientSession(
+            headers=extract_chromex.HEADERS,
+            timeout=aiohttp.ClientTimeout(total=120),
+            connector=aiohttp.TCPConnector(limit=self.args.concurrency),
+        )
+        cws_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.args.cws_workers)
+        )
+        with ThreadPoolExecutor(self.args.search_workers) as search_executor, ProcessPoolExecutor() as parse_executor:
+            async with graphql_session, cws_session:
+                reporter = asyncio.create_task(self.report())
+                fetchers = [
+                    asyncio.create_task(self.fetch_extensions(cws_session, parse_executor))
+                    for _ in range(self.args.cws_workers)
+                ]
+                try:
+                    await asyncio.gather(
+                        self.search(buckets, search_executor),
+                        self.batch_repos(),
+                        *(self.extract(graphql_session) for _ in range(self.args.concurrency)),
+                    )
+                finally:
+                    for _ in fetchers:
+                        await self.link_queue.put(None)
+                await asyncio.gather(*fetchers)
+                reporter.cancel()
+        self.print_status()
+        print()
+
+
+def load_buckets(args, num_workers, http_client, http_cache=None):
+    bucket_output_dir = os.path.join(BASE_DIR, "buckets")
+    if args.recalculate_buckets or not directory_contains_files(bucket_output_dir):
+        bucket_filepath = os.path.join(bucket_output_dir, f"{datetime.datetime.now()}.json")
+        buckets = calculate_buckets(
+            SEARCH_URL, QUERIES, num_workers, cache=http_cache, client=http_client
+        )
+        write_json_to_file(bucket_filepath, buckets)
+        return read_json_file(bucket_filepath)
+    return read_json_file(get_latest_file(bucket_output_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the search, link extraction and Web Store stages as one streaming pipeline"
+    )
+    parser.add_argument("--recalculate_buckets", action="store_true")
+    parser.add_argument(
+        "--search_workers", type=int, default=4,
+        help="Concurrent search page requests (also used for bucket count probes)",
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=25,
+        help="Repos per GraphQL request (capped at 100)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=20,
+        help="Concurrent GraphQL extraction workers",
+    )
+    parser.add_argument(
+        "--cws_workers", type=int, default=10,
+        help="Concurrent Chrome Web Store page requests",
+    )
+    parser.add_argument(
+        "--max_readme_bytes", type=int, default=DEFAULT_MAX_README_BYTES,
+        help="Skip README blobs larger than this many bytes",
+    )
+    parser.add_argument(
+        "--manifest_homepage", action="store_true",
+        help="Also take Chrome Web Store links from the manifest.json homepage_url",
+    )
+    parser.add_argument(
+        "--retry_errors", action="store_true",
+        help="Also extract repos whose extraction failed in an earlier run",
+    )
+    parser.add_argument(
+        "--parser", choices=PARSER_BACKENDS, default="bs4",
+        help="Parser backend used to extract the Web Store metadata",
+    )
+    parser.add_argument(
+        "--metadata_output_path", type=str,
+        help="Output file for the scraped Web Store metadata (default: scraped_metadata/<datetime>.json)",
+    )
+    parser.add_argument(
+        "--failed_urls_output_path", type=str,
+        help="Output file for the Web Store URLs that failed to scrape (default: next to the metadata)",
+    )
+    parser.add_argument(
+        "--extensions_output_path", type=str,
+        help="Output file for the scraped metadata keyed by extension ID",
+    )
+    parser.add_argument(
+        "--jsonl", action="store_true",
+        help="Append Web Store results to the output files as JSON lines as they complete",
+    )
+    parser.add_argument("--cache_path", type=str, help="SQLite file to cache responses in across runs")
+    parser.add_argument(
+        "--cache_ttl", type=int, default=DEFAULT_TTL,
+        help="Seconds a cached response is used before it is revalidated",
+    )
+    parser.add_argument(
+        "--compress", choices=available_compressions(),
+        help="Compress the raw search response pages",
+    )
+    parser.add_argument(
+        "--archive", action="store_true",
+        help="Pack the run's raw search response pages into a single line-delimited file",
+    )
+    parser.add_argument(
+        "--report_interval", type=int, default=2,
+        help="Seconds between progress updates",
+    )
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start_run(args.metrics_path, args.metrics_interval)
+
+    run_started = time.time()
+    run_name = str(datetime.datetime.now())
+    http_cache = HttpCache(args.cache_path, ttl=args.cache_ttl) if args.cache_path else None
+    http_client = HttpClient(pool_size=args.search_workers, headers=HEADERS)
+
+    buckets = load_buckets(args, args.search_workers, http_client, http_cache)
+
+    metadata_output_path = args.metadata_output_path or os.path.join(
+        BASE_DIR, "scraped_metadata", f"{run_name}.json"
+    )
+    failed_urls_output_path = args.failed_urls_output_path or (
+        os.path.splitext(metadata_output_path)[0] + "_failed.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(metadata_output_path)), exist_ok=True)
+
+    page_store = open_page_store(
+        os.path.join(BASE_DIR, "scraped_repos", run_name),
+        archive=args.archive,
+        compression=args.compress,
+    )
+    journal = JobJournal(JOURNAL_PATH)
+    writer = ResultWriter(metadata_output_path, failed_urls_output_path, args.jsonl)
+    pipeline = Pipeline(
+        args, page_store, journal, writer, http_client, get_token_pool(), http_cache
+    )
+    try:
+        asyncio.run(pipeline.run(buckets))
+    finally:
+        page_store.close()
+        writer.close()
+
+    if pipeline.pages_failed:
+        print(f"{pipeline.pages_failed} search pages failed, see errors.log")
+
+    extract_dir = os.path.join(BASE_DIR, "extracted_urls")
+    extracted_urls_output_filepath = os.path.join(extract_dir, f"{run_name}.json")
+    write_repo_urls(extracted_urls_output_filepath, pipeline.repos)
+    print(f"Wrote {len(pipeline.repos)} unique repos to {extracted_urls_output_filepath}")
+    added = merge_urls(LINKS_PATH, extracted_urls_output_filepath)
+    print(f"Merged {added} new repos into {LINKS_PATH}")
+
+    print(f"Journal status counts: {journal.counts()}")
+    for filename, count in journal.materialize(extract_dir).items():
+        print(f"Wrote {count} entries to {os.path.join(extract_dir, filename)}")
+
+    if args.extensions_output_path:
+        count = journal.write_extensions(args.extensions_output_path, since=run_started)
+        print(f"Wrote {count} extensions to {args.extensions_output_path}")
+    print(f"Web Store metadata for {writer.scraped_count} repos written to {metadata_output_path}")
+    print(f"Failed URLs: {writer.failed_count}, written to {failed_urls_output_path}")
+
+
+if __name__ == "__main__":
+    main()
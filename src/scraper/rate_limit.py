@@ -0,0 +1,232 @@
+import asyncio
+import email.utils
+import json
+import threading
+import time
+from urllib.parse import urlparse
+from metrics import metrics
+
+# GitHub recommends waiting at least a minute after a secondary rate limit
+# response that carries no Retry-After header
+SECONDARY_LIMIT_WAIT = 60
+# Extra seconds to wait past X-RateLimit-Reset to absorb clock skew
+RESET_MARGIN = 1
+# Pauses at least this long are announced on stdout
+ANNOUNCE_PAUSE_AFTER = 30
+
+
+def resource_for_url(url):
+    path = urlparse(url).path
+    if path.startswith("/search"):
+        return "search"
+    if path.startswith("/graphql"):
+        return "graphql"
+    return "core"
+
+
+def is_rate_limited(status, headers, body=None):
+    # Secondary rate limit 403s often carry neither Retry-After nor an
+    # exhausted X-RateLimit-Remaining, only a message in the body such as
+    # "You have exceeded a secondary rate limit"
+    if status not in (403, 429):
+        return False
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    return (
+        status == 429
+        or headers.get("Retry-After") is not None
+        or headers.get("X-RateLimit-Remaining") == "0"
+        or "rate limit" in (body or "").lower()
+    )
+
+
+def retry_after_seconds(headers, clock=time.time):
+    # Retry-After is either a number of seconds or an HTTP date
+    retry_after = headers.get("Retry-After")
+    if retry_after is None:
+        return None
+    try:
+        return max(0, int(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0, retry_at.timestamp() - clock())
+
+
+class RateLimitState:
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.used = None
+        self.reset = None
+        self.retry_until = 0
+        self.next_slot = 0
+
+
+# Tracks the GitHub rate limit headers per resource (search, core, graphql)
+# and paces requests so the remaining budget is spread evenly over the time
+# left in the window. When the budget runs out, callers are paused until the
+# reset time instead of failing.
+class RateLimitGovernor:
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.states = {}
+
+    def state(self, resource):
+        if resource not in self.states:
+            self.states[resource] = RateLimitState()
+        return self.states[resource]
+
+    # `token` is accepted so a governor and a TokenPool are interchangeable;
+    # `body` is only needed to recognize secondary rate limits
+    def update(self, resource, headers, status=200, token=None, body=None):
+        resource = headers.get("X-RateLimit-Resource", resource)
+        now = self.clock()
+        with self.lock:
+            state = self.state(resource)
+            if headers.get("X-RateLimit-Remaining") is not None:
+                state.limit = int(headers.get("X-RateLimit-Limit", 0)) or None
+                state.remaining = int(headers["X-RateLimit-Remaining"])
+                state.used = int(headers.get("X-RateLimit-Used", 0))
+                state.reset = int(headers.get("X-RateLimit-Reset", now))
+
+            if is_rate_limited(status, headers, body):
+                retry_after = retry_after_seconds(headers, self.clock)
+                if retry_after is not None:
+                    state.retry_until = now + retry_after
+                elif state.remaining == 0 and state.reset:
+                    state.retry_until = state.reset + RESET_MARGIN
+                else:
+                    state.retry_until = now + SECONDARY_LIMIT_WAIT
+
+    # For limits reported in the response body rather than the status code,
+    # such as GraphQL RATE_LIMITED errors
+    def mark_exhausted(self, resource, headers, token=None):
+        now = self.clock()
+        with self.lock:
+            state = self.state(resource)
+            state.remaining = 0
+            state.reset = int(headers.get("X-RateLimit-Reset", now + SECONDARY_LIMIT_WAIT))
+            state.retry_until = state.reset + RESET_MARGIN
+
+    def rollover(self, state, now):
+        if state.reset is not None and now >= state.reset + RESET_MARGIN:
+            # window rolled over; the next response reports the new budget
+            state.remaining = None
+            state.reset = None
+
+    # Returns (time the resource is usable again, remaining budget), where an
+    # unknown budget counts as unlimited
+    def budget(self, resource):
+        now = self.clock()
+        with self.lock:
+            state = self.state(resource)
+            self.rollover(state, now)
+            available_at = state.retry_until
+            if state.remaining is not None and state.remaining <= 0:
+                available_at = max(available_at, state.reset + RESET_MARGIN)
+            remaining = float("inf") if state.remaining is None else state.remaining
+            return available_at, remaining
+
+    # Reserve the next request slot for `resource`; returns seconds to wait
+    def reserve(self, resource):
+        now = self.clock()
+        with self.lock:
+            state = self.state(resource)
+            self.rollover(state, now)
+
+            slot = max(now, state.next_slot, state.retry_until)
+            if state.remaining is not None and state.remaining <= 0:
+                slot = max(slot, state.reset + RESET_MARGIN)
+            elif state.remaining is not None:
+                interval = max(0, state.reset - slot) / state.remaining
+                state.next_slot = slot + interval
+                state.remaining -= 1
+            return slot - now
+
+    def announce(self, resource, delay):
+        if delay >= ANNOUNCE_PAUSE_AFTER:
+            resume_at = time.strftime("%H:%M:%S", time.localtime(self.clock() + delay))
+            print(f"\nRate limit for {resource} exhausted, pausing until {resume_at}")
+
+    # Blocks until a request may be sent; returns the token to send it with,
+    # which is None for a bare governor
+    def wait(self, resource):
+        delay = self.reserve(resource)
+        if delay > 0:
+            self.announce(resource, delay)
+            metrics.inc("rate_limit_wait_seconds_total", delay, resource=resource)
+            time.sleep(delay)
+        return None
+
+    async def wait_async(self, resource):
+        delay = self.reserve(resource)
+        if delay > 0:
+            self.announce(resource, delay)
+            metrics.inc("rate_limit_wait_seconds_total", delay, resource=resource)
+            await asyncio.sleep(delay)
+        return None
+
+
+# Reads the GitHub tokens from secret.json, which holds either a list under
+# "github_access_tokens" or a single "github_access_token"
+def load_github_tokens(secret_filepath):
+    with open(secret_filepath) as json_file:
+        json_data = json.load(json_file)
+    tokens = json_data.get("github_access_tokens") or [json_data["github_access_token"]]
+    return list(dict.fromkeys(tokens))
+
+
+# Dispatches requests over several GitHub tokens, each with its own
+# governor. Every request goes to the usable token with the most remaining
+# budget for the resource (round-robin among equals), and exhausted tokens
+# are retired until their reset time, so N tokens give roughly N times the
+# throughput of one.
+class TokenPool:
+    def __init__(self, tokens, clock=time.time):
+        if not tokens:
+            raise ValueError("At least one GitHub access token is required")
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.tokens = list(tokens)
+        self.governors = {token: RateLimitGovernor(clock) for token in self.tokens}
+        self.turn = 0
+
+    def select(self, resource):
+        now = self.clock()
+        with self.lock:
+            order = self.tokens[self.turn:] + self.tokens[: self.turn]
+            self.turn = (self.turn + 1) % len(self.tokens)
+            budgets = {token: self.governors[token].budget(resource) for token in order}
+            usable = [token for token in order if budgets[token][0] <= now]
+            if usable:
+                token = max(usable, key=lambda t: budgets[t][1])
+            else:
+                token = min(order, key=lambda t: budgets[t][0])
+            return token, self.governors[token].reserve(resource)
+
+    def update(self, resource, headers, status=200, token=None, body=None):
+        self.governors[token].update(resource, headers, status, body=body)
+
+    def mark_exhausted(self, resource, headers, token=None):
+        self.governors[token].mark_exhausted(resource, headers)
+
+    def wait(self, resource):
+        token, delay = self.select(resource)
+        if delay > 0:
+            self.governors[token].announce(resource, delay)
+            metrics.inc("rate_limit_wait_seconds_total", delay, resource=resource)
+            time.sleep(delay)
+        return token
+
+    async def wait_async(self, resource):
+        token, delay = self.select(resource)
+        if delay > 0:
+            self.governors[token].announce(resource, delay)
+            metrics.inc("rate_limit_wait_seconds_total", delay, resource=resource)
+            await asyncio.sleep(delay)
+        return token
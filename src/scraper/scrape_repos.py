@@ -1,10 +1,14 @@
-import json
 import os
+import sys
 import datetime
 import time
 import math
 import argparse
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils import (
+    HttpClient,
     fetch_with_rety,
     write_json_to_file,
     get_latest_file,
@@ -13,74 +17,213 @@ from utils import (
     directory_contains_files,
 )
 
-from extract_repo_urls import extract_urls
+from extract_repo_urls import extract_urls, merge_urls
+from functools import lru_cache
+from rate_limit import TokenPool, load_github_tokens
+from http_cache import HttpCache, DEFAULT_TTL
+from storage import open_page_store, available_compressions
+from metrics import metrics
 
+# Optional on-disk response cache, enabled with --cache_path
+http_cache = None
 
-def get_params(query, page=1):
-    return {"q": query, "per_page": 100, "page": page}
 
+# Lower bound of the created: dimension used to split single-size buckets
+FIRST_CREATED_DATE = "2008-01-01"
 
-def get_github_acess_token():
-    this_directory = os.path.dirname(os.path.abspath(__file__))
-    secret_filepath = os.path.join(this_directory, "secret.json")
-    with open(secret_filepath) as json_file:
-        json_data = json.load(json_file)
-        github_access_token = json_data["github_access_token"]
+SEARCH_URL = "https://api.github.com/search/repositories"
+QUERIES = [
+    "chromewebstore.google.com in:readme",
+    "chrome.google.com/webstore in:readme",
+]
 
-    return github_access_token
 
+def get_params(query, page=1, per_page=100):
+    return {"q": query, "per_page": per_page, "page": page}
 
-def get_headers():
-    return {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {get_github_acess_token()}",
-        "X-GitHub-Api-Version": "2022-11-28",
-    }
 
+@lru_cache(maxsize=None)
+def get_token_pool():
+    # Shared by every GitHub request made by this process; fetch_with_rety
+    # adds the Authorization header of the token each request is routed to
+    this_directory = os.path.dirname(os.path.abspath(__file__))
+    secret_filepath = os.path.join(this_directory, "secret.json")
+    return TokenPool(load_github_tokens(secret_filepath))
 
-def find_buckets(url, query, min_size_in_kb=0, max_size_in_kb=1000000):
-    buckets = list()
 
-    filtered_query = f"{query} size:{min_size_in_kb}..{max_size_in_kb}"
-    total_items = items_returned(url, filtered_query)
-    remaining_items = total_items
+HEADERS = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28",
+}
 
-    while remaining_items > 0 and max_size_in_kb > 0:
-        filtered_query = f"{query} size:{min_size_in_kb}..{max_size_in_kb}"
-        amount_returned = items_returned(url, filtered_query)
+# Pooled keep-alive client sending HEADERS with every request; main
+# replaces it with one sized to its workers. Functions that take cache and
+# client arguments fall back to http_cache and http_client.
+http_client = HttpClient(headers=HEADERS)
 
-        while amount_returned > 1000:
-            min_size_in_kb = int((max_size_in_kb + min_size_in_kb) / 2)
-            filtered_query = f"{query} size:{min_size_in_kb}..{max_size_in_kb}"
-            amount_returned = items_returned(url, filtered_query)
 
-        buckets.append(
+def filter_query(query, bucket):
+    filtered_query = (
+        f"{query} size:{bucket['min_size_in_kb']}..{bucket['max_size_in_kb']}"
+    )
+    if "created_after" in bucket:
+        filtered_query += f" created:{bucket['created_after']}..{bucket['created_before']}"
+    return filtered_query
+
+
+def split_bucket(bucket):
+    # Halve the size range; once it is a single size, halve the created range
+    min_size, max_size = bucket["min_size_in_kb"], bucket["max_size_in_kb"]
+    if min_size < max_size:
+        mid = (min_size + max_size) // 2
+        return [
+            {**bucket, "max_size_in_kb": mid},
+            {**bucket, "min_size_in_kb": mid + 1},
+        ]
+
+    created_after = date.fromisoformat(bucket.get("created_after", FIRST_CREATED_DATE))
+    created_before = date.fromisoformat(
+        bucket.get("created_before", (date.today() + timedelta(days=1)).isoformat())
+    )
+    if created_after < created_before:
+        mid = created_after + (created_before - created_after) // 2
+        return [
             {
-                "min_size_in_kb": min_size_in_kb,
-                "max_size_in_kb": max_size_in_kb,
-                "query": filtered_query,
-                "number_of_items": amount_returned,
-            }
-        )
-        remaining_items -= amount_returned
-        max_size_in_kb = min_size_in_kb - 1
-        min_size_in_kb = 0
-        print_progress(total_items - remaining_items, total_items)
+                **bucket,
+                "created_after": created_after.isoformat(),
+                "created_before": mid.isoformat(),
+            },
+            {
+                **bucket,
+                "created_after": (mid + timedelta(days=1)).isoformat(),
+                "created_before": created_before.isoformat(),
+            },
+        ]
+    return None
+
+
+def partition_buckets(
+    url,
+    query,
+    min_size_in_kb=0,
+    max_size_in_kb=1000000,
+    num_workers=4,
+    cache=None,
+    client=None,
+):
+    # Counts are probed with per_page=1 and cached per range. Both halves of
+    # a split range are probed: search counts are approximate, so the
+    # parent's count minus one half's is not a reliable count of the other.
+    # Each level of the split is probed in parallel until every range fits
+    # under GitHub's 1000 result cap.
+    max_items_allowed_by_github = 1000
+    counts = dict()
+
+    def count(bucket):
+        key = filter_query(query, bucket)
+        if key not in counts:
+            counts[key] = items_returned(url, key, per_page=1, cache=cache, client=client)
+        return counts[key]
+
+    root = {"min_size_in_kb": min_size_in_kb, "max_size_in_kb": max_size_in_kb}
+    total_items = count(root)
+    pending = [(root, total_items)]
+    buckets = list()
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        while pending:
+            splits = list()
+            for bucket, amount_returned in pending:
+                if amount_returned == 0:
+                    continue
+                halves = None
+                if amount_returned > max_items_allowed_by_github:
+                    halves = split_bucket(bucket)
+                    if halves is None:
+                        print(f"\nCannot split {filter_query(query, bucket)} further")
+                if halves is None:
+                    buckets.append(
+                        {
+                            **bucket,
+                            "query": filter_query(query, bucket),
+                            "number_of_items": amount_returned,
+                        }
+                    )
+                else:
+                    splits += halves
+
+            pending = list(zip(splits, executor.map(count, splits)))
+
+            found = sum(b.get("number_of_items", 0) for b in buckets)
+            print_progress(min(found, total_items), max(total_items, 1))
 
     total_found = sum(b.get("number_of_items", 0) for b in buckets)
     print(f"\nFound a total of {total_found} out of {total_items} items.")
     return buckets
 
 
-def items_returned(url, query):
-    params = get_params(query, 1)
-    headers = get_headers()
-    response = fetch_with_rety(url, params, headers)
+def items_returned(url, query, per_page=100, cache=None, client=None):
+    params = get_params(query, 1, per_page)
+    response = fetch_with_rety(
+        url,
+        params,
+        governor=get_token_pool(),
+        cache=http_cache if cache is None else cache,
+        client=http_client if client is None else client,
+    )
     response_json = response.json()
     return response_json["total_count"]
 
 
-def bucket_fetch_repos(url, buckets_filepath, output_dir):
+def high_water_marks(bucket_output_dir):
+    # The latest high-water mark recorded for each base query across full and
+    # incremental bucket files
+    marks = dict()
+    incremental_dir = os.path.join(bucket_output_dir, "incremental")
+    for directory in (bucket_output_dir, incremental_dir):
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            filepath = os.path.join(directory, filename)
+            if not os.path.isfile(filepath):
+                continue
+            for bucket in read_json_file(filepath):
+                query = bucket.get("base_query")
+                mark = bucket.get("high_water_mark")
+                if query and mark and mark > marks.get(query, ""):
+                    marks[query] = mark
+    return marks
+
+
+def calculate_buckets(url, queries, num_workers, pushed_since=None, cache=None, client=None):
+    # Every bucket records its base query and the time its computation
+    # started, which is the high-water mark the next incremental run
+    # queries from. Anything pushed after it is picked up again next time.
+    all_buckets = []
+    for query in queries:
+        high_water_mark = datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%S+00:00"
+        )
+        search_query = query
+        if pushed_since and pushed_since.get(query):
+            search_query = f"{query} pushed:>{pushed_since[query]}"
+        print(f"Calculating buckets for q={search_query}. This may take awhile...")
+
+        buckets = partition_buckets(
+            url, search_query, num_workers=num_workers, cache=cache, client=client
+        )
+        if not buckets:
+            # nothing found: an empty bucket still advances the mark
+            buckets = [{"query": search_query, "number_of_items": 0}]
+        for bucket in buckets:
+            bucket["base_query"] = query
+            bucket["high_water_mark"] = high_water_mark
+        all_buckets += buckets
+
+    return all_buckets
+
+
+def bucket_fetch_repos(url, buckets_filepath, page_store):
     buckets = read_json_file(buckets_filepath)
     print(f"Fetching {len(buckets)} buckets. This may take awhile...")
 
@@ -89,14 +232,81 @@ def bucket_fetch_repos(url, buckets_filepath, output_dir):
     items_found = 0
 
     for bucket_index, bucket in enumerate(buckets):
+        if pages_in_bucket(bucket) == 0:
+            continue
         query = bucket.get("query")
         repo_response_pages = fetch_paged_repos(url, query)
         for page, repo_json in repo_response_pages:
-            filename = f"bucket_{bucket_index}_page_{page}.json"
-            filepath = os.path.join(output_dir, filename)
             items_found += len(repo_json.get("items", []))
-            write_json_to_file(filepath, repo_json)
+            page_store.write(f"bucket_{bucket_index}_page_{page}", repo_json)
+            print_progress(items_found, total_items)
+    elapsed_time = time.time() - start_time
+    print(
+        f"\nFound a total of {items_found} out of {total_items} items in {elapsed_time:.2f} seconds."
+    )
+
+
+def pages_in_bucket(bucket):
+    max_items_allowed_by_github = 1000
+    items_per_page = 100
+    number_of_items = min(bucket.get("number_of_items"), max_items_allowed_by_github)
+    if number_of_items == 0:
+        # empty buckets only record a high-water mark
+        return 0
+    return max(1, math.ceil(number_of_items / items_per_page))
+
+
+def fetch_bucket_page(url, query, page, cache=None, client=None, pool=None):
+    params = get_params(query, page)
+    response = fetch_with_rety(
+        url,
+        params,
+        governor=pool or get_token_pool(),
+        cache=http_cache if cache is None else cache,
+        client=http_client if client is None else client,
+    )
+    repo_json = response.json()
+    metrics.inc("items_total", len(repo_json.get("items", [])), stage="search")
+    return repo_json
+
+
+def bucket_pages(buckets):
+    # (bucket index, query, page) of every page; the page count of every
+    # bucket is known from the partitioning counts
+    return [
+        (bucket_index, bucket.get("query"), page)
+        for bucket_index, bucket in enumerate(buckets)
+        for page in range(1, pages_in_bucket(bucket) + 1)
+    ]
+
+
+def bucket_fetch_repos_concurrent(url, buckets_filepath, page_store, num_workers):
+    buckets = read_json_file(buckets_filepath)
+    print(f"Fetching {len(buckets)} buckets with {num_workers} workers...")
+
+    start_time = time.time()
+    total_items = sum(bucket.get("number_of_items") for bucket in buckets)
+    items_found = 0
+    progress_lock = threading.Lock()
+
+    # All pages are scheduled up front and each one is written as soon as it
+    # arrives
+    def fetch_page(bucket_index, query, page):
+        nonlocal items_found
+        repo_json = fetch_bucket_page(url, query, page)
+        page_store.write(f"bucket_{bucket_index}_page_{page}", repo_json)
+        with progress_lock:
+            items_found += len(repo_json.get("items", []))
             print_progress(items_found, total_items)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(fetch_page, bucket_index, query, page)
+            for bucket_index, query, page in bucket_pages(buckets)
+        ]
+        for future in as_completed(futures):
+            future.result()
+
     elapsed_time = time.time() - start_time
     print(
         f"\nFound a total of {items_found} out of {total_items} items in {elapsed_time:.2f} seconds."
@@ -110,68 +320,129 @@ def fetch_paged_repos(url, query):
 
     max_allowed_pages = upper_max_page_limit
     page = 1
-    response_pages = []
     while page <= max_allowed_pages:
         params = get_params(query, page)
-        headers = get_headers()
-        response = fetch_with_rety(url, params, headers)
+        response = fetch_with_rety(
+            url,
+            params,
+            governor=get_token_pool(),
+            cache=http_cache,
+            client=http_client,
+        )
         response_json = response.json()
+        metrics.inc("items_total", len(response_json.get("items", [])), stage="search")
 
         total_items = response_json.get("total_count", max_items_allowed_by_github)
         pages_required = math.ceil(total_items / items_per_page)
         max_allowed_pages = min(pages_required, upper_max_page_limit)
-        response_pages.append((page, response_json))
+        yield page, response_json
         page += 1
 
-    return response_pages
-
 
 if __name__ == "__main__":
     this_directory = os.path.dirname(os.path.abspath(__file__))
-    url = "https://api.github.com/search/repositories"
-    queries = [
-        "chromewebstore.google.com in:readme",
-        "chrome.google.com/webstore in:readme",
-    ]
+    url = SEARCH_URL
+    queries = QUERIES
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--recalculate_buckets", action="store_true")
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        help="SQLite file to cache search responses in across runs",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=int,
+        default=DEFAULT_TTL,
+        help="Seconds a cached response is used before it is revalidated",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        help="Fetch pages of all buckets concurrently with this many workers (also used for bucket count probes)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only scrape repos pushed since the high-water mark of the last run",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=available_compressions(),
+        help="Compress the raw search response pages",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="Pack the run's raw search response pages into a single line-delimited file",
+    )
+    metrics.add_arguments(parser)
     args = parser.parse_args()
+    metrics.start_run(args.metrics_path, args.metrics_interval)
+
+    if args.cache_path:
+        http_cache = HttpCache(args.cache_path, ttl=args.cache_ttl)
+    http_client = HttpClient(pool_size=args.num_workers or 4, headers=HEADERS)
 
     bucket_output_dir = os.path.join(this_directory, "buckets")
     any_buckets_computed_yet = directory_contains_files(bucket_output_dir)
-    
-    should_calculate_buckets = not any_buckets_computed_yet or args.recalculate_buckets
-    if should_calculate_buckets:
+
+    if args.incremental:
+        pushed_since = high_water_marks(bucket_output_dir)
+        missing = [query for query in queries if query not in pushed_since]
+        if missing:
+            print(f"No high-water mark recorded for {missing}; run a full scrape first.")
+            sys.exit(1)
+        bucket_filename = f"{str(datetime.datetime.now())}.json"
+        bucket_filepath = os.path.join(bucket_output_dir, "incremental", bucket_filename)
+        all_buckets = calculate_buckets(
+            url, queries, args.num_workers or 4, pushed_since
+        )
+        write_json_to_file(bucket_filepath, all_buckets)
+        buckets_file_to_scrape = bucket_filepath
+    elif not any_buckets_computed_yet or args.recalculate_buckets:
         bucket_filename = f"{str(datetime.datetime.now())}.json"
         bucket_filepath = os.path.join(bucket_output_dir, bucket_filename)
-        all_buckets = []
-        for bucket_query in queries:
-            print(f"Calculating buckets for q={bucket_query}. This may take awhile...")
-
-            buckets = find_buckets(
-                url,
-                bucket_query,
-            )
-
-            all_buckets += buckets
-
+        all_buckets = calculate_buckets(url, queries, args.num_workers or 4)
         write_json_to_file(bucket_filepath, all_buckets)
-
-    buckets_file_to_scrape = (
-        bucket_filepath
-        if should_calculate_buckets
-        else get_latest_file(bucket_output_dir)
+        buckets_file_to_scrape = bucket_filepath
+    else:
+        buckets_file_to_scrape = get_latest_file(bucket_output_dir)
+
+    page_store = open_page_store(
+        os.path.join(this_directory, "scraped_repos", str(datetime.datetime.now())),
+        archive=args.archive,
+        compression=args.compress,
     )
 
-    scraped_repo_output_dir = os.path.join(
-        this_directory, "scraped_repos", str(datetime.datetime.now())
-    )
+    if args.num_workers:
+        bucket_fetch_repos_concurrent(
+            url, buckets_file_to_scrape, page_store, args.num_workers
+        )
+    else:
+        bucket_fetch_repos(url, buckets_file_to_scrape, page_store)
+    page_store.close()
 
-    bucket_fetch_repos(url, buckets_file_to_scrape, scraped_repo_output_dir)
+    if page_store.count == 0:
+        print("No repositories found.")
+        sys.exit(0)
 
     extracted_urls_output_filepath = os.path.join(
         this_directory, "extracted_urls", f"{datetime.datetime.now()}.json"
     )
 
-    extract_urls(scraped_repo_output_dir, extracted_urls_output_filepath)
+    extract_urls(
+        page_store.path, extracted_urls_output_filepath, args.num_workers
+    )
+
+    if args.incremental:
+        github_links_filepath = os.path.join(
+            this_directory, "extracted_urls", "github_links.json"
+        )
+        added = merge_urls(github_links_filepath, extracted_urls_output_filepath)
+        print(f"Merged {added} new repos into {github_links_filepath}")
+        print(
+            "To extract links for the updated repos only, run:\n"
+            f"  python3 src/scraper/extract_chromex.py --links_path \"{extracted_urls_output_filepath}\""
+        )
@@ -0,0 +1,150 @@
+import os
+import io
+import json
+import gzip
+import threading
+from metrics import metrics
+
+# orjson and zstandard are optional: without them JSON is encoded with the
+# standard library and zstd compression is unavailable
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# compression -> file name suffix
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def available_compressions():
+    return [name for name in COMPRESSION_SUFFIXES if name and (name != "zstd" or zstandard)]
+
+
+# UTF-8 encoded JSON
+def dumps(data, compact=True) -> bytes:
+    if compact:
+        if orjson:
+            return orjson.dumps(data)
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return json.dumps(data, indent=4).encode("utf-8")
+
+
+def loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def compression_for(filepath):
+    if filepath.endswith(".gz"):
+        return "gzip"
+    if filepath.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def open_write(filepath, compression=None):
+    if compression == "gzip":
+        return gzip.open(filepath, "wb", compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(open(filepath, "wb"))
+    return open(filepath, "wb")
+
+
+def open_read(filepath):
+    # Compressed files are recognized by their magic bytes, not their name
+    f = open(filepath, "rb")
+    magic = f.read(4)
+    f.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        f.close()
+        return gzip.open(filepath, "rb")
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            f.close()
+            raise RuntimeError(f"{filepath} is zstd compressed; install zstandard to read it")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, closefd=True))
+    return f
+
+
+def write_json(filepath, data, compact=True, compression=None):
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    with metrics.timer("storage_write_seconds"):
+        encoded = dumps(data, compact)
+        with open_write(filepath, compression) as f:
+            f.write(encoded)
+    metrics.inc("storage_write_bytes_total", len(encoded))
+
+
+def read_json(filepath):
+    with open_read(filepath) as f:
+        return loads(f.read())
+
+
+# One file per search response page, as scrape_repos has always written them
+class PageDirectory:
+    def __init__(self, path, compression=None):
+        self.path = path
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, name, data):
+        filename = name + ".json" + COMPRESSION_SUFFIXES[self.compression]
+        write_json(os.path.join(self.path, filename), data, compression=self.compression)
+        with self.lock:
+            self.count += 1
+
+    def close(self):
+        pass
+
+
+# All pages of a run in a single line-delimited file, one
+# {"name": ..., "data": ...} record per line, so later stages open one file
+# instead of thousands
+class PageArchive:
+    def __init__(self, path, compression=None):
+        self.path = path + ".jsonl" + COMPRESSION_SUFFIXES[compression]
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = open_write(self.path, compression)
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, name, data):
+        with metrics.timer("storage_write_seconds"):
+            line = dumps({"name": name, "data": data}) + b"\n"
+            with self.lock:
+                self.file.write(line)
+                self.count += 1
+        metrics.inc("storage_write_bytes_total", len(line))
+
+    def close(self):
+        self.file.close()
+
+
+def open_page_store(path, archive=False, compression=None):
+    if archive:
+        return PageArchive(path, compression)
+    return PageDirectory(path, compression)
+
+
+def iter_archive_lines(filepath):
+    with open_read(filepath) as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def iter_archive(filepath):
+    for line in iter_archive_lines(filepath):
+        record = loads(line)
+        yield record["name"], record["data"]
@@ -0,0 +1,40 @@
+import unittest
+from adaptive_concurrency import AIMDController
+
+
+class TestAIMDController(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.controller = AIMDController(
+            initial=4, floor=2, ceiling=6, clock=lambda: self.now
+        )
+
+    def test_additive_increase(self):
+        for _ in range(4):
+            self.now += 0.1
+            self.controller.record(200, 0.1)
+        self.assertAlmostEqual(self.controller.limit, 5.0, delta=0.1)
+        for _ in range(100):
+            self.now += 0.1
+            self.controller.record(200, 0.1)
+        self.assertEqual(self.controller.limit, 6)
+
+    def test_multiplicative_decrease(self):
+        self.now += 0.1
+        self.controller.record(200, 0.5)
+        limit = self.controller.limit
+        self.controller.record(429, 0.5)
+        self.assertAlmostEqual(self.controller.limit, limit / 2)
+        # the rest of the same burst does not cut again within a round trip
+        self.controller.record(503, 0.5)
+        self.assertAlmostEqual(self.controller.limit, limit / 2)
+        # ...but a latency spike after it does, down to the floor
+        self.now += 1
+        self.controller.record(200, 5.0)
+        self.assertEqual(self.controller.limit, 2)
+        self.assertEqual(self.controller.counts["throttled"], 2)
+        self.assertEqual(self.controller.counts["slow"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import os
+import zipfile
+import tempfile
+from archive_index import ArchiveIndex, find_archives, index_archives
+
+
+class TestArchiveIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = os.path.join(self.tmp_dir.name, "data")
+        self.write_zip("ext-a", "ext-a-src.zip", {"src/lib.js": b"shared", "src/a.js": b"a"})
+        self.write_zip("ext-a", "ext-a-dist.zip", {"lib.js": b"shared"})
+        self.write_zip("ext-b", "ext-b-dist.zip", {"vendor/lib.js": b"shared", "b.js": b"b"})
+        self.index = ArchiveIndex(os.path.join(self.tmp_dir.name, "index.sqlite3"))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp_dir.cleanup()
+
+    def write_zip(self, extension, name, files):
+        os.makedirs(os.path.join(self.data_dir, extension), exist_ok=True)
+        with zipfile.ZipFile(os.path.join(self.data_dir, extension, name), "w") as zf:
+            for path, data in files.items():
+                zf.writestr(path, data)
+
+    def test_duplicates(self):
+        archives = find_archives(self.data_dir)
+        self.assertEqual(index_archives(self.index, archives, num_workers=2), (3, 5))
+
+        duplicates = list(self.index.duplicates(across_extensions=True))
+        self.assertEqual(len(duplicates), 1)
+        _, size, occurrences = duplicates[0]
+        self.assertEqual(size, len(b"shared"))
+        self.assertEqual(
+            occurrences,
+            [
+                ("ext-a", "dist", "lib.js"),
+                ("ext-a", "src", "src/lib.js"),
+                ("ext-b", "dist", "vendor/lib.js"),
+            ],
+        )
+        self.assertEqual(self.index.stats()["unique_files"], 3)
+
+    def test_reindex_changed_archives_only(self):
+        index_archives(self.index, find_archives(self.data_dir), num_workers=1)
+        self.write_zip("ext-b", "ext-b-dist.zip", {"b.js": b"b2"})
+        os.remove(os.path.join(self.data_dir, "ext-a", "ext-a-dist.zip"))
+
+        archives = find_archives(self.data_dir)
+        self.assertEqual(index_archives(self.index, archives, num_workers=1), (1, 1))
+        self.assertEqual(list(self.index.duplicates()), [])
+        self.assertEqual(self.index.stats()["archives"], 2)
+        self.assertEqual(self.index.stats()["unique_files"], 3)
+
+    def assert_ext_b_forgotten(self):
+        archives = find_archives(self.data_dir)
+        self.assertEqual(index_archives(self.index, archives, num_workers=1), (0, 0))
+        self.assertEqual(self.index.stats()["archives"], 2)
+        self.assertEqual(
+            [occurrences for _, _, occurrences in self.index.duplicates()],
+            [[("ext-a", "dist", "lib.js"), ("ext-a", "src", "src/lib.js")]],
+        )
+        self.assertEqual(self.index.stats()["unique_files"], 2)
+
+    def test_unreadable_archive_is_forgotten(self):
+        index_archives(self.index, find_archives(self.data_dir), num_workers=1)
+        with open(os.path.join(self.data_dir, "ext-b", "ext-b-dist.zip"), "wb") as f:
+            f.write(b"not a zip file")
+        self.assert_ext_b_forgotten()
+
+    def test_truncated_archive_is_forgotten(self):
+        index_archives(self.index, find_archives(self.data_dir), num_workers=1)
+        filepath = os.path.join(self.data_dir, "ext-b", "ext-b-dist.zip")
+        # cut off the central directory, as an interrupted download would
+        os.truncate(filepath, os.path.getsize(filepath) // 2)
+        self.assert_ext_b_forgotten()
+
+    def test_corrupted_entry_is_forgotten(self):
+        index_archives(self.index, find_archives(self.data_dir), num_workers=1)
+        filepath = os.path.join(self.data_dir, "ext-b", "ext-b-dist.zip")
+        with open(filepath, "rb") as f:
+            data = f.read()
+        # the archive still opens, but one member fails its CRC check
+        with open(filepath, "wb") as f:
+            f.write(data.replace(b"shared", b"SHARED"))
+
+        archives = find_archives(self.data_dir)
+        self.assertEqual(index_archives(self.index, archives, num_workers=1), (1, 1))
+        self.assertEqual(self.index.stats()["archives"], 3)
+        self.assertEqual(
+            [occurrences for _, _, occurrences in self.index.duplicates()],
+            [[("ext-a", "dist", "lib.js"), ("ext-a", "src", "src/lib.js")]],
+        )
+        self.assertEqual(self.index.stats()["unique_files"], 3)
+
+if __name__ == "__main__":
+    unittest.main()
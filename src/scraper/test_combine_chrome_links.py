@@ -0,0 +1,64 @@
+import unittest
+import os
+import json
+import tempfile
+from combine_chrome_links import combine_chrome_links, fragment_order, read_fragment
+
+
+class TestCombineChromeLinks(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.extract_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, filename, text):
+        filepath = os.path.join(self.extract_dir, filename)
+        with open(filepath, "w") as f:
+            f.write(text)
+        return filepath
+
+    def read(self, filename):
+        with open(os.path.join(self.extract_dir, filename)) as f:
+            return json.load(f)
+
+    def test_fragment_order(self):
+        filenames = [
+            "chrome_links_new_20240105_0_500.json",
+            "chrome_links_1000_1500.json",
+            "chrome_links_new_20240105_500_1000.json",
+            "chrome_links_500_1000.json",
+            "chrome_links_0_500.json",
+        ]
+        self.assertEqual(
+            sorted(filenames, key=fragment_order),
+            [
+                "chrome_links_0_500.json",
+                "chrome_links_500_1000.json",
+                "chrome_links_1000_1500.json",
+                "chrome_links_new_20240105_0_500.json",
+                "chrome_links_new_20240105_500_1000.json",
+            ],
+        )
+
+    def test_read_fragment(self):
+        valid = self.write("chrome_links_0_2.json", '{"a": ["x"], "b": ["y", "z"]}')
+        truncated = self.write("chrome_links_2_4.json", '{"c": ["x"], "d": [')
+        self.assertEqual(read_fragment(valid), {"a": ["x"], "b": ["y", "z"]})
+        self.assertEqual(read_fragment(truncated), {})
+
+    def test_combine(self):
+        self.write("github_links.json", json.dumps(["a", "b", "c", "d"]))
+        self.write("chrome_links_2_10.json", json.dumps({"a": ["z", "x"]}))
+        self.write("chrome_links_0_2.json", json.dumps({"a": ["x", "y"]}))
+        self.write("chrome_links_noext_0_2.json", json.dumps(["b"]))
+        combine_chrome_links(self.extract_dir)
+
+        self.assertEqual(self.read("chrome_links.json"), {"a": ["x", "y", "z"]})
+        self.assertEqual(self.read("chrome_links_noext.json"), ["b"])
+        self.assertEqual(self.read("chrome_links_remaining.json"), ["c", "d"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,16 @@
 import unittest
-from cws_page_fetcher import extract_metadata
+from cws_page_fetcher import (
+    PARSER_BACKENDS,
+    ExtensionFanOut,
+    ResultWriter,
+    extract_metadata,
+    parse_metadata,
+)
+from cws_metadata_parser import extract_metadata_fast
+import json
 from utils import read_html_file, read_txt_file
 import os
+import tempfile
 from bs4 import BeautifulSoup
 import re
 
@@ -54,6 +63,46 @@ class TestCwsPageFetcher(unittest.TestCase):
             },
         )
 
+    def test_fast_parser(self):
+        for fixture in ["dark-reader-cws.html", "google-scraper-cws.html"]:
+            html = read_html_file(os.path.join(self.fixtures_dir, fixture))
+            soup = BeautifulSoup(html, "html.parser")
+            self.assertDictEqual(extract_metadata_fast(html), extract_metadata(soup))
+
+    def test_parser_backends(self):
+        html = read_html_file(os.path.join(self.fixtures_dir, "dark-reader-cws.html"))
+        dom_metadata = extract_metadata(BeautifulSoup(html, "html.parser"))
+        for backend in PARSER_BACKENDS:
+            self.assertDictEqual(parse_metadata(html, backend), dom_metadata)
+
+    def test_fan_out_releases_extensions(self):
+        url = "https://chromewebstore.google.com/detail/x/"
+        a, b = "a" * 32, "b" * 32
+        results = list()
+        fan_out = ExtensionFanOut(
+            {"repo1": [url + a], "repo2": [url + a, url + b]},
+            lambda result, failed: results.append(result["repo_url"]),
+        )
+        fan_out.extension_done(a, {"version": "1"}, None)
+        self.assertEqual(results, ["repo1"])
+        # repo2 still needs a
+        self.assertIn(a, fan_out.store)
+        fan_out.extension_done(b, {"version": "2"}, None)
+        self.assertEqual(results, ["repo1", "repo2"])
+        self.assertEqual(fan_out.store, {})
+
+    def test_jsonl_writer_creates_directories(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, "out", "metadata.jsonl")
+            writer = ResultWriter(output_path, os.path.join(tmp_dir, "out", "failed.jsonl"), True)
+            writer.write(
+                {"repo_url": "repo", "scraped_metadata": [{"version": "1", "cws_url": "u"}]}, []
+            )
+            writer.close()
+            self.assertEqual((writer.repo_count, writer.scraped_count), (1, 1))
+            with open(output_path) as f:
+                self.assertEqual(json.loads(f.readline())["repo_url"], "repo")
+
 
 if __name__ == "__main__":
     unittest.main()
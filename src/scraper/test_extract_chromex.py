@@ -0,0 +1,80 @@
+import unittest
+import os
+import asyncio
+import tempfile
+from unittest import mock
+import extract_chromex
+from extract_chromex import fetch_and_extract_batch, revalidate, run_workers, FAILED
+from journal import JobJournal, DONE, NO_MANIFEST, ERROR
+
+
+class TestFetchAndExtractBatch(unittest.TestCase):
+    def test_failed_blob_request_is_an_error(self):
+        tree = {
+            "defaultBranchRef": {"target": {"oid": "abc"}},
+            "manifest": {"byteSize": 10},
+            "root": {"entries": [{"name": "README.md", "object": {"byteSize": 10}}]},
+        }
+        readme = {"b0": {"text": "https://chromewebstore.google.com/detail/x/" + "a" * 32}}
+        # phase one: three repos with a manifest and one without; phase two:
+        # one README, one failed request and one repo gone since phase one
+        responses = [[tree, tree, tree, {"manifest": None}], [readme, FAILED, None]]
+
+        async def post_with_split(session, items, build_query, labels, pool=None):
+            return responses.pop(0)
+
+        repo_urls = [f"https://github.com/o/r{i}" for i in range(4)]
+        with mock.patch.object(extract_chromex, "post_with_split", post_with_split):
+            results = asyncio.run(fetch_and_extract_batch(None, repo_urls))
+
+        statuses = {repo_url: status for repo_url, status, _, _ in results}
+        self.assertEqual(
+            statuses,
+            {
+                repo_urls[0]: DONE,
+                repo_urls[1]: ERROR,
+                repo_urls[2]: ERROR,
+                repo_urls[3]: NO_MANIFEST,
+            },
+        )
+
+
+class TestRevalidate(unittest.TestCase):
+    def test_missing_repos_are_requeued_only_when_retrying(self):
+        repo_urls = [f"https://github.com/o/r{i}" for i in range(4)]
+        # moved, unchanged, missing or empty, failed request
+        oids = {repo_urls[0]: "b", repo_urls[1]: "a", repo_urls[2]: None, repo_urls[3]: FAILED}
+
+        async def fetch_head_oids(session, batch):
+            return [(repo_url, oids[repo_url]) for repo_url in batch]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            journal = JobJournal(os.path.join(tmp_dir, "journal.sqlite3"))
+            journal.add(repo_urls)
+            expected = [(False, [repo_urls[0]]), (True, [repo_urls[0], repo_urls[2]])]
+            for retry_missing, pending in expected:
+                journal.record([(repo_url, NO_MANIFEST, None, "a") for repo_url in repo_urls])
+                with mock.patch.object(extract_chromex, "fetch_head_oids", fetch_head_oids):
+                    asyncio.run(revalidate(None, journal, 2, retry_missing))
+                self.assertEqual(journal.pending(), pending)
+
+
+class TestRunWorkers(unittest.TestCase):
+    def test_dead_worker_stops_producer(self):
+        # results handling that raises kills the worker; the producer must
+        # not block forever on the full queue
+        def on_results(results):
+            raise RuntimeError("disk full")
+
+        async def process(batch):
+            return batch
+
+        batches = [[f"repo{i}"] for i in range(100)]
+        run = run_workers(batches, process, on_results, num_workers=2)
+        with self.assertRaises(ExceptionGroup) as raised:
+            asyncio.run(asyncio.wait_for(run, timeout=5))
+        self.assertIsInstance(raised.exception.exceptions[0], RuntimeError)
+
+
+if __name__ == "__main__":
+    unittest.main()
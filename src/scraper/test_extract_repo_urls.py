@@ -0,0 +1,74 @@
+import unittest
+import os
+import json
+import tempfile
+from extract_repo_urls import extract_urls, index_filepath_for
+
+
+def repo(i):
+    return {
+        "id": i,
+        "html_url": f"https://github.com/owner/repo{i}",
+        "full_name": f"owner/repo{i}",
+        "size": i * 10,
+        "pushed_at": "2024-01-01T00:00:00Z",
+        "stargazers_count": i,
+    }
+
+
+class TestExtractRepoUrls(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pages_dir = os.path.join(self.tmp_dir.name, "pages")
+        os.makedirs(self.pages_dir)
+        # bucket_10 sorts after bucket_2; repos 2 and 3 match both queries
+        pages = {
+            "bucket_0_page_1.json": [repo(1), repo(2)],
+            "bucket_0_page_2.json": [repo(3)],
+            "bucket_2_page_1.json": [repo(4), repo(2)],
+            "bucket_10_page_1.json": [repo(3), repo(5)],
+        }
+        for filename, items in pages.items():
+            with open(os.path.join(self.pages_dir, filename), "w") as f:
+                json.dump({"items": items}, f)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_dedupe_and_index(self):
+        output_filepath = os.path.join(self.tmp_dir.name, "out", "urls.json")
+        extract_urls(self.pages_dir, output_filepath, num_workers=2)
+
+        with open(output_filepath) as f:
+            self.assertEqual(
+                json.load(f), [repo(i)["html_url"] for i in [1, 2, 3, 4, 5]]
+            )
+        with open(index_filepath_for(output_filepath)) as f:
+            index = json.load(f)
+        self.assertEqual(
+            index["fields"], ["id", "full_name", "size", "pushed_at", "stargazers"]
+        )
+        self.assertEqual(
+            index["repos"][1], [2, "owner/repo2", 20, "2024-01-01T00:00:00Z", 2]
+        )
+        self.assertEqual([row[0] for row in index["repos"]], [1, 2, 3, 4, 5])
+
+    def test_archive(self):
+        # pages in the order concurrent search workers wrote them
+        archive_path = os.path.join(self.tmp_dir.name, "pages.jsonl")
+        with open(archive_path, "w") as f:
+            for filename in sorted(os.listdir(self.pages_dir), reverse=True):
+                with open(os.path.join(self.pages_dir, filename)) as page:
+                    record = {"name": filename[:-5], "data": json.load(page)}
+                f.write(json.dumps(record) + "\n")
+        output_filepath = os.path.join(self.tmp_dir.name, "urls.json")
+        extract_urls(archive_path, output_filepath, num_workers=2)
+
+        with open(output_filepath) as f:
+            self.assertEqual(
+                json.load(f), [repo(i)["html_url"] for i in [1, 2, 3, 4, 5]]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import os
+import itertools
+import tempfile
+from unittest import mock
+import requests
+import http_cache
+from http_cache import HttpCache
+from utils import HttpClient
+
+
+def make_response(status, body=b"", headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    response._content = body
+    return response
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp_dir.name, "cache.sqlite3")
+        # every call to the clock is a second later, so access order is strict
+        clock = itertools.count(1000)
+        patcher = mock.patch.object(http_cache.time, "time", lambda: next(clock))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_stale_entry_is_revalidated(self):
+        cache = HttpCache(self.cache_path, ttl=0)
+        client = HttpClient()
+        url = "https://api.github.com/search/repositories"
+        responses = [
+            make_response(200, b'{"total_count": 1}', {"ETag": '"v1"'}),
+            make_response(304),
+        ]
+        with mock.patch.object(client.session, "get", side_effect=responses) as get:
+            first = client.get(url, {"q": "x"}, cache=cache)
+            second = client.get(url, {"q": "x"}, cache=cache)
+
+        self.assertEqual(get.call_count, 2)
+        self.assertNotIn("If-None-Match", get.call_args_list[0].kwargs["headers"] or {})
+        self.assertEqual(get.call_args_list[1].kwargs["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual(first.json(), {"total_count": 1})
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), {"total_count": 1})
+
+    def test_least_recently_used_is_evicted(self):
+        cache = HttpCache(self.cache_path, max_bytes=10)
+        cache.store("a", None, 200, {}, b"aaaa")
+        cache.store("b", None, 200, {}, b"bbbb")
+        cache.get("a")
+        cache.store("c", None, 200, {}, b"cccc")
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+
+    def test_size_limit_is_shared_across_instances(self):
+        # e.g. two scripts running with the same --cache_path
+        first = HttpCache(self.cache_path, max_bytes=10)
+        second = HttpCache(self.cache_path, max_bytes=10)
+        first.store("a", None, 200, {}, b"aaaa")
+        second.store("b", None, 200, {}, b"bbbb")
+        first.store("c", None, 200, {}, b"cccc")
+        self.assertIsNone(second.get("a"))
+        self.assertIsNotNone(second.get("b"))
+        self.assertIsNotNone(second.get("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import os
+import json
+import tempfile
+from journal import JobJournal, DONE, NO_MANIFEST, NO_LINK, ERROR
+
+
+class TestJobJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.tmp_dir.name, "journal.sqlite3")
+        self.urls = [f"https://github.com/owner/repo{i}" for i in range(5)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume(self):
+        journal = JobJournal(self.journal_path)
+        journal.add(self.urls)
+        journal.record(
+            [
+                (self.urls[0], DONE, ["https://chromewebstore.google.com/detail/x"], "a1"),
+                (self.urls[1], ERROR, None, None),
+            ]
+        )
+
+        resumed = JobJournal(self.journal_path)
+        resumed.add(self.urls)
+        self.assertEqual(resumed.pending(), self.urls[2:])
+        self.assertEqual(resumed.pending(retry_errors=True), self.urls[1:])
+        self.assertEqual(resumed.recorded_oids(), {self.urls[0]: "a1"})
+
+        resumed.requeue([self.urls[0]])
+        self.assertEqual(resumed.pending(), [self.urls[0]] + self.urls[2:])
+
+        # repos added after reopening are queued after the journaled ones
+        extra = "https://github.com/owner/extra"
+        resumed.add([extra])
+        self.assertEqual(resumed.pending()[-1], extra)
+
+    def test_materialize(self):
+        journal = JobJournal(self.journal_path)
+        journal.add(self.urls)
+        journal.record(
+            [
+                (self.urls[3], DONE, ["https://chromewebstore.google.com/detail/b"], "b1"),
+                (self.urls[0], DONE, ["https://chromewebstore.google.com/detail/a"], "a1"),
+                (self.urls[1], NO_LINK, [], "c1"),
+                (self.urls[2], NO_MANIFEST, None, "d1"),
+            ]
+        )
+        journal.materialize(self.tmp_dir.name)
+
+        def read(filename):
+            with open(os.path.join(self.tmp_dir.name, filename)) as f:
+                return json.load(f)
+
+        self.assertEqual(
+            list(read("chrome_links.json").items()),
+            [
+                (self.urls[0], ["https://chromewebstore.google.com/detail/a"]),
+                (self.urls[3], ["https://chromewebstore.google.com/detail/b"]),
+            ],
+        )
+        self.assertEqual(read("chrome_links_noext.json"), [self.urls[1]])
+        self.assertEqual(
+            read("chrome_links_remaining.json"), [self.urls[2], self.urls[4]]
+        )
+
+    def test_extensions(self):
+        journal = JobJournal(self.journal_path)
+        journal.record_extension("a", {"name": "A"}, None)
+        journal.record_extension("b", None, "Scraping failed")
+        self.assertEqual(
+            journal.extension_results(["a", "b", "c"]),
+            {"a": ({"name": "A"}, None), "b": (None, "Scraping failed")},
+        )
+        filepath = os.path.join(self.tmp_dir.name, "extensions.json")
+        self.assertEqual(journal.write_extensions(filepath), 1)
+        with open(filepath) as f:
+            self.assertEqual(json.load(f), {"a": {"name": "A"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
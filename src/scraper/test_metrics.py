@@ -0,0 +1,47 @@
+import unittest
+import os
+import json
+import tempfile
+from metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.metrics = Metrics(clock=lambda: self.now)
+
+    def test_counters_and_histograms(self):
+        self.metrics.inc("http_requests_total", host="api.github.com", status=200)
+        self.metrics.inc("http_requests_total", host="api.github.com", status=200)
+        self.metrics.inc("http_requests_total", host="api.github.com", status="timeout")
+        for seconds in [0.02] * 98 + [3.0, 3.0]:
+            self.metrics.observe("http_request_seconds", seconds, host="api.github.com")
+
+        histogram = self.metrics.histograms["http_request_seconds"][(("host", "api.github.com"),)]
+        self.assertEqual(histogram.quantile(0.5), 0.025)
+        self.assertEqual(histogram.quantile(0.99), 5)
+
+        text = self.metrics.to_prometheus()
+        self.assertIn('http_requests_total{host="api.github.com",status="200"} 2', text)
+        self.assertIn(
+            'http_request_seconds_bucket{host="api.github.com",le="+Inf"} 100', text
+        )
+        self.assertIn("http_requests_total", self.metrics.summary())
+
+    def test_write_json(self):
+        self.metrics.inc("items_total", 5, stage="cws")
+        self.now += 10
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "metrics.json")
+            self.metrics.write(filepath)
+            with open(filepath) as f:
+                snapshot = json.load(f)
+        self.assertEqual(snapshot["elapsed_seconds"], 10)
+        self.assertEqual(
+            snapshot["counters"]["items_total"], [{"labels": {"stage": "cws"}, "value": 5}]
+        )
+        self.assertIn("items_total{stage=\"cws\"} 5 (0.5/s)", self.metrics.summary())
+
+
+if __name__ == "__main__":
+    unittest.main()
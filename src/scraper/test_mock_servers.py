@@ -0,0 +1,45 @@
+import unittest
+import zlib
+import requests
+from cws_metadata_parser import extract_metadata_fast
+from mock_servers import start_mock_servers, stop_mock_servers, mock_extension_id
+
+
+class TestMockServers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, cls.github_url, cls.webstore_url = start_mock_servers(
+            github_options=dict(num_repos=1500, rate_limit=3, rate_window=60)
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_mock_servers(cls.server)
+
+    def test_search_paging_and_rate_limit(self):
+        url = f"{self.github_url}/search/repositories"
+        response = requests.get(url, params={"q": "x", "per_page": 100, "page": 2})
+        self.assertEqual(response.json()["total_count"], 1500)
+        self.assertEqual(response.json()["items"][0]["id"], 100)
+        self.assertEqual(response.headers["X-RateLimit-Remaining"], "2")
+
+        response = requests.get(url, params={"q": "x", "per_page": 100, "page": 11})
+        self.assertEqual(response.status_code, 422)
+
+        requests.get(url, params={"q": "x"})
+        response = requests.get(url, params={"q": "x"})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.headers["X-RateLimit-Remaining"], "0")
+
+    def test_webstore_fixture_page(self):
+        # the page is chosen by crc32 of the ID over the sorted fixtures, which
+        # is google-scraper-cws.html (index 1) for this ID
+        ext_id = mock_extension_id(7)
+        self.assertEqual(zlib.crc32(ext_id.encode()) % 2, 1)
+        response = requests.get(f"{self.webstore_url}/detail/{ext_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(extract_metadata_fast(response.text)["version"], "1.0.1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import json
+import asyncio
+import argparse
+import tempfile
+from unittest import mock
+import extract_chromex
+import cws_page_fetcher
+import pipeline
+from pipeline import Pipeline
+from cws_page_fetcher import ResultWriter
+from journal import JobJournal, DONE, NO_MANIFEST, NO_LINK
+from rate_limit import TokenPool
+from storage import open_page_store
+from utils import HttpClient
+from mock_servers import start_mock_servers, stop_mock_servers
+
+
+class TestPipeline(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # 100 repos: the 50 even ones have a manifest, and every other one of
+        # those links to one of 5 extensions
+        cls.server, cls.github_url, cls.webstore_url = start_mock_servers(
+            github_options=dict(num_repos=100, num_extensions=10)
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        stop_mock_servers(cls.server)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, *names):
+        return os.path.join(self.tmp_dir.name, *names)
+
+    def read_lines(self, filepath):
+        with open(filepath) as f:
+            return [json.loads(line) for line in f]
+
+    def test_end_to_end(self):
+        args = argparse.Namespace(
+            search_workers=2,
+            batch_size=10,
+            concurrency=2,
+            cws_workers=2,
+            max_readme_bytes=extract_chromex.DEFAULT_MAX_README_BYTES,
+            manifest_homepage=False,
+            retry_errors=False,
+            parser="fast",
+            report_interval=60,
+        )
+        buckets = [{"query": "extension", "number_of_items": 100}]
+        page_store = open_page_store(self.path("pages"))
+        journal = JobJournal(self.path("journal.sqlite3"))
+        writer = ResultWriter(self.path("metadata.jsonl"), self.path("failed.jsonl"), jsonl=True)
+        run = Pipeline(
+            args, page_store, journal, writer, HttpClient(), TokenPool(["token"])
+        )
+        with mock.patch.object(
+            pipeline, "SEARCH_URL", f"{self.github_url}/search/repositories"
+        ), mock.patch.object(
+            extract_chromex, "GRAPHQL_URL", f"{self.github_url}/graphql"
+        ), mock.patch.object(
+            cws_page_fetcher, "CWS_DETAIL_URL", f"{self.webstore_url}/detail"
+        ):
+            try:
+                asyncio.run(run.run(buckets))
+            finally:
+                page_store.close()
+                writer.close()
+
+        self.assertEqual(run.pages_done, 1)
+        self.assertEqual(len(run.repos), 100)
+        self.assertEqual(journal.counts(), {DONE: 25, NO_LINK: 25, NO_MANIFEST: 50})
+        self.assertEqual(run.extensions_started, 5)
+        self.assertEqual(os.listdir(self.path("pages")), ["bucket_0_page_1.json"])
+
+        scraped = self.read_lines(self.path("metadata.jsonl"))
+        self.assertEqual(len(scraped), 25)
+        self.assertTrue(all(len(result["scraped_metadata"]) == 1 for result in scraped))
+        self.assertEqual(self.read_lines(self.path("failed.jsonl")), [])
+
+        extensions_path = self.path("extensions.json")
+        self.assertEqual(journal.write_extensions(extensions_path), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
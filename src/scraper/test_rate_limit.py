@@ -0,0 +1,112 @@
+import json
+import os
+import tempfile
+import unittest
+from email.utils import formatdate
+from rate_limit import (
+    RateLimitGovernor,
+    RESET_MARGIN,
+    SECONDARY_LIMIT_WAIT,
+    TokenPool,
+    is_rate_limited,
+    load_github_tokens,
+    retry_after_seconds,
+)
+
+
+class FakeClock:
+    def __init__(self, now=1000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimitGovernor(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.governor = RateLimitGovernor(self.clock)
+
+    def test_429_waits_for_retry_after(self):
+        self.governor.update("core", {"Retry-After": "30"}, status=429)
+        self.assertEqual(self.governor.reserve("core"), 30)
+
+    def test_primary_limit_waits_for_reset(self):
+        headers = {
+            "X-RateLimit-Limit": "30",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": "1100",
+        }
+        self.governor.update("search", headers, status=403)
+        self.assertEqual(self.governor.reserve("search"), 100 + RESET_MARGIN)
+
+    def test_secondary_limit_from_body(self):
+        headers = {"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": "4600"}
+        body = b'{"message": "You have exceeded a secondary rate limit."}'
+        self.assertFalse(is_rate_limited(403, headers))
+        self.assertTrue(is_rate_limited(403, headers, body))
+        self.assertFalse(is_rate_limited(403, headers, b'{"message": "Forbidden"}'))
+
+        self.governor.update("core", headers, status=403, body=body)
+        self.assertEqual(self.governor.reserve("core"), SECONDARY_LIMIT_WAIT)
+
+    def test_retry_after_http_date(self):
+        headers = {"Retry-After": formatdate(self.clock() + 45, usegmt=True)}
+        self.assertEqual(retry_after_seconds(headers, self.clock), 45)
+
+        self.governor.update("core", headers, status=429)
+        self.assertEqual(self.governor.reserve("core"), 45)
+
+    def test_pacing_spreads_budget_over_window(self):
+        headers = {"X-RateLimit-Remaining": "4", "X-RateLimit-Reset": "1100"}
+        self.governor.update("core", headers)
+        delays = [self.governor.reserve("core") for _ in range(4)]
+        self.assertEqual(delays, [0, 25, 50, 75])
+        # budget spent: the next request waits for the reset
+        self.assertEqual(self.governor.reserve("core"), 100 + RESET_MARGIN)
+
+
+class TestTokenPool(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = TokenPool(["a", "b", "c"], self.clock)
+
+    def report(self, token, remaining, reset=1100):
+        headers = {"X-RateLimit-Remaining": str(remaining), "X-RateLimit-Reset": str(reset)}
+        self.pool.update("core", headers, token=token)
+
+    def test_selects_most_remaining_budget(self):
+        self.report("a", 10)
+        self.report("b", 500)
+        self.report("c", 20)
+        self.assertEqual([self.pool.select("core")[0] for _ in range(3)], ["b"] * 3)
+
+    def test_exhausted_token_retired_until_reset(self):
+        self.pool = TokenPool(["a", "b"], self.clock)
+        self.report("a", 0)
+        self.report("b", 0, reset=1200)
+        # both exhausted: the one that resets first is chosen and waited for
+        self.assertEqual(self.pool.select("core"), ("a", 100 + RESET_MARGIN))
+
+        self.report("b", 50, reset=1200)
+        for _ in range(2):
+            self.assertEqual(self.pool.select("core")[0], "b")
+
+        self.clock.now = 1100 + RESET_MARGIN
+        # "a" rolled over to an unknown, so unlimited, budget
+        self.assertEqual(self.pool.select("core"), ("a", 0))
+
+    def test_load_github_tokens(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            secret_filepath = os.path.join(tmp_dir, "secret.json")
+            with open(secret_filepath, "w") as f:
+                json.dump({"github_access_tokens": ["a", "b", "a"]}, f)
+            self.assertEqual(load_github_tokens(secret_filepath), ["a", "b"])
+
+            with open(secret_filepath, "w") as f:
+                json.dump({"github_access_token": "a"}, f)
+            self.assertEqual(load_github_tokens(secret_filepath), ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import re
+import os
+import unittest
+import tempfile
+from unittest import mock
+import scrape_repos
+from scrape_repos import (
+    partition_buckets,
+    calculate_buckets,
+    high_water_marks,
+    bucket_pages,
+)
+from utils import write_json_to_file
+
+
+class TestPartitionBuckets(unittest.TestCase):
+    def test_counts_both_halves(self):
+        # 2500 repos of size 0..2499 KB, plus 300 that the unfiltered count
+        # includes but no size range finds (search counts are approximate)
+        probed = list()
+
+        def items_returned(url, query, per_page=100, cache=None, client=None):
+            probed.append(query)
+            low, high = map(int, re.search(r"size:(\d+)\.\.(\d+)", query).groups())
+            found = max(0, min(high, 2499) - low + 1)
+            return found + 300 if (low, high) == (0, 1000000) else found
+
+        with mock.patch.object(scrape_repos, "items_returned", items_returned):
+            buckets = partition_buckets("url", "q", num_workers=2)
+
+        self.assertEqual(sum(bucket["number_of_items"] for bucket in buckets), 2500)
+        self.assertTrue(all(bucket["number_of_items"] <= 1000 for bucket in buckets))
+        self.assertEqual(len(probed), len(set(probed)))
+
+
+class TestHighWaterMarks(unittest.TestCase):
+    def test_mark_advances_when_nothing_is_found(self):
+        with tempfile.TemporaryDirectory() as bucket_output_dir:
+            old_mark = "2024-01-01T00:00:00+00:00"
+            write_json_to_file(
+                os.path.join(bucket_output_dir, "full.json"),
+                [{"base_query": "q", "high_water_mark": old_mark, "number_of_items": 5}],
+            )
+            pushed_since = high_water_marks(bucket_output_dir)
+            self.assertEqual(pushed_since, {"q": old_mark})
+
+            with mock.patch.object(scrape_repos, "partition_buckets", return_value=[]):
+                buckets = calculate_buckets("url", ["q"], 1, pushed_since)
+            self.assertEqual(bucket_pages(buckets), [])
+
+            write_json_to_file(
+                os.path.join(bucket_output_dir, "incremental", "run.json"), buckets
+            )
+            new_mark = high_water_marks(bucket_output_dir)["q"]
+            self.assertGreater(new_mark, old_mark)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import os
+import gc
+import tempfile
+import warnings
+from storage import open_page_store, iter_archive
+from metrics import metrics
+from utils import write_json_to_file, read_json_file
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data = {"items": [{"id": 1, "html_url": "https://github.com/o/r"}]}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_compressed_round_trip(self):
+        filepath = os.path.join(self.tmp_dir.name, "page.json.gz")
+        write_json_to_file(filepath, self.data, compact=True, compression="gzip")
+        with open(filepath, "rb") as f:
+            self.assertEqual(f.read(2), b"\x1f\x8b")
+        self.assertEqual(read_json_file(filepath), self.data)
+
+        # the underlying file is closed along with the gzip stream
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always", ResourceWarning)
+            read_json_file(filepath)
+            gc.collect()
+        self.assertEqual([w for w in caught if w.category is ResourceWarning], [])
+
+    def test_archive(self):
+        store = open_page_store(
+            os.path.join(self.tmp_dir.name, "run"), archive=True, compression="gzip"
+        )
+        store.write("bucket_0_page_1", self.data)
+        store.write("bucket_0_page_2", {"items": []})
+        store.close()
+
+        self.assertTrue(store.path.endswith("run.jsonl.gz"))
+        self.assertEqual(
+            list(iter_archive(store.path)),
+            [("bucket_0_page_1", self.data), ("bucket_0_page_2", {"items": []})],
+        )
+
+    def test_write_bytes_metric(self):
+        def written():
+            counters = metrics.snapshot()["counters"]
+            return sum(series["value"] for series in counters.get("storage_write_bytes_total", []))
+
+        data = {"overview": "Тёмный режим für jede Website ✓"}
+        for compact in (True, False):
+            filepath = os.path.join(self.tmp_dir.name, f"compact_{compact}.json")
+            before = written()
+            write_json_to_file(filepath, data, compact=compact)
+            self.assertEqual(written() - before, os.path.getsize(filepath))
+            self.assertEqual(read_json_file(filepath), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
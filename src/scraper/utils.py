@@ -1,9 +1,14 @@
 import os
-import json
 import logging
 import requests
+import aiohttp
+import asyncio
 import time
 import sys
+import random
+from rate_limit import resource_for_url, is_rate_limited, retry_after_seconds
+from storage import write_json, read_json
+from metrics import metrics, host_of
 
 logging.basicConfig(
     level=logging.WARNING,
@@ -15,15 +20,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def write_json_to_file(filepath, json_data):
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, "w") as f:
-        json.dump(json_data, f, indent=4)
+def write_json_to_file(filepath, json_data, compact=False, compression=None):
+    # Indented by default; intermediate files can be written compact and
+    # gzip/zstd compressed (see storage.py)
+    write_json(filepath, json_data, compact=compact, compression=compression)
 
 
 def read_json_file(filepath):
-    with open(filepath) as f:
-        return json.load(f)
+    # Decompresses gzip/zstd files transparently
+    return read_json(filepath)
 
 
 def read_html_file(filepath):
@@ -63,28 +68,208 @@ def print_progress(iteration, total, length=40):
     sys.stdout.flush()
 
 
-def fetch_with_rety(url, params, headers, max_retries=5, request_timeout=5):
-    delay = 1
+# Cap on a single (jittered) backoff between attempts
+MAX_BACKOFF = 60
+
+
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        return retry_after
+    # jitter keeps concurrent workers from retrying in lockstep
+    delay = min(MAX_BACKOFF, 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class HttpClient:
+    # Thread-safe client over one pooled keep-alive requests.Session, so the
+    # workers of a stage share connections (and TLS handshakes) for the
+    # whole run. pool_size should match the number of workers.
+    def __init__(self, pool_size=10, headers=None, max_retries=5, request_timeout=5):
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers or {})
+
+    def get(
+        self,
+        url,
+        params=None,
+        headers=None,
+        max_retries=None,
+        request_timeout=None,
+        governor=None,
+        cache=None,
+    ):
+        max_retries = max_retries or self.max_retries
+        request_timeout = request_timeout or self.request_timeout
+        host = host_of(url)
+        cached = cache.get(url, params) if cache else None
+        if cached and cache.is_fresh(cached):
+            metrics.inc("http_cache_hits_total", host=host)
+            return cache.to_response(cached)
+
+        resource = resource_for_url(url)
+        attempt = 0
+        while attempt < max_retries:
+            request_headers = headers
+            if cached:
+                request_headers = {**(headers or {}), **cache.conditional_headers(cached)}
+            token = governor.wait(resource) if governor else None
+            if token:
+                request_headers = {**(request_headers or {}), "Authorization": f"Bearer {token}"}
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = self.session.get(
+                    url, params=params, headers=request_headers, timeout=request_timeout
+                )
+                metrics.observe("http_request_seconds", time.perf_counter() - started, host=host)
+                metrics.inc("http_requests_total", host=host, status=response.status_code)
+                metrics.inc("http_response_bytes_total", len(response.content), host=host)
+
+                if governor:
+                    governor.update(
+                        resource,
+                        response.headers,
+                        response.status_code,
+                        token=token,
+                        body=response.content,
+                    )
+                    if is_rate_limited(
+                        response.status_code, response.headers, response.content
+                    ):
+                        # the governor pauses the next attempt until the limit resets
+                        logger.warning(f"Rate limited on {resource}: {response.text}")
+                        continue
+
+                if cached and response.status_code == 304:
+                    cache.revalidated(cached)
+                    metrics.inc("http_cache_hits_total", host=host)
+                    return cache.to_response(cached)
+                if response.ok:
+                    if cache:
+                        cache.store_response(url, params, response)
+                    return response
+                else:
+                    logger.error(f"Request Error {response.status_code}: {response.text}")
+                    retry_after = retry_after_seconds(response.headers)
+
+            except requests.exceptions.Timeout:
+                metrics.inc("http_requests_total", host=host, status="timeout")
+                logger.error(
+                    f"Request Error: Request timed out after {request_timeout} seconds."
+                )
+            except requests.exceptions.RequestException as e:
+                metrics.inc("http_requests_total", host=host, status="error")
+                logger.error(f"Request Error: {e}")
+
+            logger.warning(f"Backing off. Attempt: {attempt}/{max_retries}...")
+            delay = backoff_delay(attempt, retry_after)
+            metrics.inc("http_retries_total", host=host)
+            metrics.inc("http_backoff_seconds_total", delay, host=host)
+            time.sleep(delay)
+            attempt += 1
+
+        raise Exception("Max retries exceeded")
+
+
+# Used when a stage does not set up its own client
+default_client = HttpClient()
+
+
+def fetch_with_rety(
+    url,
+    params,
+    headers=None,
+    max_retries=None,
+    request_timeout=None,
+    governor=None,
+    cache=None,
+    client=None,
+):
+    # headers are added to the client's own; max_retries and request_timeout
+    # default to the client's settings
+    return (client or default_client).get(
+        url,
+        params=params,
+        headers=headers,
+        max_retries=max_retries,
+        request_timeout=request_timeout,
+        governor=governor,
+        cache=cache,
+    )
+
+
+async def fetch_with_rety_async(
+    session,
+    url,
+    params=None,
+    headers=None,
+    max_retries=5,
+    request_timeout=5,
+    cache=None,
+    controller=None,
+):
+    # controller (an AIMDController) gates every attempt and is told the
+    # status and latency of each one
+    host = host_of(url)
+    cached = cache.get(url, params) if cache else None
+    if cached and cache.is_fresh(cached):
+        metrics.inc("http_cache_hits_total", host=host)
+        return cache.to_response(cached).text
+    if cached:
+        headers = {**(headers or {}), **cache.conditional_headers(cached)}
+
+    timeout = aiohttp.ClientTimeout(total=request_timeout)
     for attempt in range(max_retries):
+        retry_after = None
+        status = None
+        if controller:
+            await controller.acquire()
+        started = time.monotonic()
         try:
-            response = requests.get(
-                url, params=params, headers=headers, timeout=request_timeout
-            )
-
-            if response.ok:
-                return response
-            else:
-                logger.error(f"Request Error {response.status_code}: {response.text}")
+            async with session.get(
+                url, params=params, headers=headers, timeout=timeout
+            ) as response:
+                body = await response.read()
+                status = response.status
+                metrics.observe("http_request_seconds", time.monotonic() - started, host=host)
+                metrics.inc("http_requests_total", host=host, status=status)
+                metrics.inc("http_response_bytes_total", len(body), host=host)
+                if cached and response.status == 304:
+                    cache.revalidated(cached)
+                    metrics.inc("http_cache_hits_total", host=host)
+                    return cache.to_response(cached).text
+                text = body.decode(response.get_encoding(), errors="replace")
+                if response.ok:
+                    if cache:
+                        cache.store(url, params, response.status, response.headers, body)
+                    return text
+                else:
+                    logger.error(f"Request Error {response.status}: {text}")
+                    retry_after = retry_after_seconds(response.headers)
 
-        except requests.exceptions.Timeout:
+        except asyncio.TimeoutError:
+            metrics.inc("http_requests_total", host=host, status="timeout")
             logger.error(
                 f"Request Error: Request timed out after {request_timeout} seconds."
             )
-        except requests.exceptions.RequestException as e:
+        except aiohttp.ClientError as e:
+            metrics.inc("http_requests_total", host=host, status="error")
             logger.error(f"Request Error: {e}")
+        finally:
+            if controller:
+                await controller.release(status, time.monotonic() - started)
 
         logger.warning(f"Backing off. Attempt: {attempt}/{max_retries}...")
-        time.sleep(delay)
-        delay *= 2
+        delay = backoff_delay(attempt, retry_after)
+        metrics.inc("http_retries_total", host=host)
+        metrics.inc("http_backoff_seconds_total", delay, host=host)
+        await asyncio.sleep(delay)
 
     raise Exception("Max retries exceeded")